@@ -1,10 +1,16 @@
 import os
 
-import pandas as pd
-import requests
-import yfinance as yf
+from llm_in_production.http_client import aget_json, get_json
+from llm_in_production.tool_cache import ttl_cache
 
+# The APIs can be pointed elsewhere, e.g. to a local stub server in a benchmark.
+# All requests go over the shared connection pool of `llm_in_production.http_client`.
+NEWS_API_URL = os.getenv("NEWS_API_URL", "https://newsapi.org/v2")
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.weatherapi.com/v1")
 
+
+# Prices change during the day, so they are only reused for a minute.
+@ttl_cache(ttl=60)
 def get_stock_prices(company_stock_ticker_symbol: str, period: str = "1mo") -> dict:
     # YOUR CODE HERE START
     """Get recent information about a given stock.
@@ -13,6 +19,7 @@ def get_stock_prices(company_stock_ticker_symbol: str, period: str = "1mo") -> d
     :param days: How far to look back
     :return: The recent price information about a given stock.
     """
+    import yfinance as yf
 
     # time.sleep(4) #To avoid rate limit error
     stock = yf.Ticker(company_stock_ticker_symbol)
@@ -24,6 +31,7 @@ def get_stock_prices(company_stock_ticker_symbol: str, period: str = "1mo") -> d
     return df.to_json()
 
 
+@ttl_cache(ttl=15 * 60)
 def get_news_stories(topic: str) -> dict:
     # YOUR CODE HERE START
     """Get the (stock) topic headlines from a given topic
@@ -31,28 +39,75 @@ def get_news_stories(topic: str) -> dict:
     :param topic: The (stock) topic you want to retrieve news stories about, e.g. "Microsoft".
     :return: The top headlines for that (stock) topic
     """
+    response = get_json(f"{NEWS_API_URL}/everything", params=_get_news_params(topic))
+    # YOUR CODE HERE END
+    return _get_titles(response)
+
+
+@ttl_cache(ttl=15 * 60)
+async def aget_news_stories(topic: str) -> dict:
+    """Get the (stock) topic headlines from a given topic
+
+    :param topic: The (stock) topic you want to retrieve news stories about, e.g. "Microsoft".
+    :return: The top headlines for that (stock) topic
+    """
+    response = await aget_json(
+        f"{NEWS_API_URL}/everything", params=_get_news_params(topic)
+    )
+    return _get_titles(response)
+
+
+def _get_news_params(topic: str) -> dict:
+    import pandas as pd
+
     today = pd.Timestamp.today()
-    start = today.date
-    end = today - pd.Timedelta(days=30)
-    end = end.date
+    start = today - pd.Timedelta(days=30)
     for term in ["stock", "news"]:
         if term not in topic:
             topic += f" {term}"
-    request = requests.get(
-        f"https://newsapi.org/v2/everything?q={topic}&from={start}&to={end}&sortBy=popularity&apiKey={os.environ['NEWS_API_KEY']}"
-    ).json()
-    articles = pd.DataFrame(request["articles"])
+    return {
+        "q": topic,
+        "from": start.date().isoformat(),
+        "to": today.date().isoformat(),
+        "sortBy": "popularity",
+        "apiKey": os.environ["NEWS_API_KEY"],
+    }
+
+
+def _get_titles(response: dict) -> str:
+    import pandas as pd
+
+    if "articles" not in response:
+        # e.g. an invalid API key, raised so the model gets the message and the error is not cached.
+        raise ValueError(response.get("message", response))
+    articles = pd.DataFrame(response["articles"])
     titles = articles["title"]
-    # YOUR CODE HERE END
     return titles.to_json()
 
 
+@ttl_cache(ttl=5 * 60)
 def get_current_weather(location: str) -> dict:
     """Get the current weather conditions in a given location
 
     :param location: The city (and state), e.g. "San Francisco, CA"
     :return: The weather conditions
     """
-    return requests.get(
-        f"https://api.weatherapi.com/v1/current.json?key={os.environ['WEATHER_API_KEY']}&q={location}"
-    ).json()
+    return get_json(
+        f"{WEATHER_API_URL}/current.json", params=_get_weather_params(location)
+    )
+
+
+@ttl_cache(ttl=5 * 60)
+async def aget_current_weather(location: str) -> dict:
+    """Get the current weather conditions in a given location
+
+    :param location: The city (and state), e.g. "San Francisco, CA"
+    :return: The weather conditions
+    """
+    return await aget_json(
+        f"{WEATHER_API_URL}/current.json", params=_get_weather_params(location)
+    )
+
+
+def _get_weather_params(location: str) -> dict:
+    return {"key": os.environ["WEATHER_API_KEY"], "q": location}
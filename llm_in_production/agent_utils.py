@@ -1,8 +1,14 @@
+import asyncio
 import inspect
 import json
 import logging
 import re
-from typing import Any, Callable, Dict
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, Literal, NamedTuple
 
 from langchain_core.utils.function_calling import convert_to_openai_function
 
@@ -15,25 +21,226 @@ logging.getLogger("langchain_google_vertexai.chat_models").setLevel(logging.ERRO
 # Suppress LangChain verbose logs (optional)
 logging.getLogger("langchain").setLevel(logging.WARNING)
 
+# The seconds a tool may take before the agent continues without its result.
+DEFAULT_TOOL_TIMEOUT = 30.0
+
+# The tool calls of all agents run in this pool, as most tools spend their time waiting on a web API.
+# A tool that times out keeps its thread until it returns, as a thread cannot be interrupted.
+tool_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="agent-tool")
+
+_tool_event_loop: asyncio.AbstractEventLoop | None = None
+_tool_event_loop_lock = threading.Lock()
+
+
+def get_tool_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the event loop that runs the async tools of the sync agents, in a background thread.
+    All calls share it, so they share e.g. the connection pool of `http_client.get_async_http_client`,
+    instead of opening a new event loop and client for every call.
+    :return: The running event loop.
+    """
+    global _tool_event_loop
+    with _tool_event_loop_lock:
+        if _tool_event_loop is None:
+            _tool_event_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_tool_event_loop.run_forever,
+                name="agent-tool-loop",
+                daemon=True,
+            ).start()
+        return _tool_event_loop
+
+
+class AgentEvent(NamedTuple):
+    """Something that happened while an agent runs, see `run_agent`."""
+
+    kind: Literal[
+        "model_output", "tool_start", "tool_result", "final_answer", "max_iterations"
+    ]
+    content: str = ""
+    tool_name: str | None = None
+    tool_args: Dict[str, Any] | None = None
+
+
+class ToolRegistryInfo(NamedTuple):
+    hits: int
+    misses: int
+    currsize: int
+
+
+class ToolRegistry:
+    """
+    Computes the schemas of a tool once per function object, instead of introspecting its signature
+    and parsing its docstring for every agent run.
+
+    The schemas are kept in a `WeakKeyDictionary`, so they are dropped together with the function,
+    e.g. when a notebook cell redefines a tool. The returned schemas are shared and must not be modified.
+    """
+
+    def __init__(self):
+        self._schemas: weakref.WeakKeyDictionary[
+            Callable, dict[str, dict]
+        ] = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_tool_definition(self, tool: Callable) -> dict:
+        """
+        Get the definition of a tool that is passed to the model, with `convert_to_openai_function`.
+        :param tool: The function.
+        :return: The tool definition.
+        """
+        return self._get_schema(tool, "definition", _create_tool_definition)
+
+    def get_function_json(self, tool: Callable) -> dict:
+        """
+        Get the JSON description of a tool, see `function_to_json`.
+        :param tool: The function.
+        :return: The JSON description.
+        """
+        return self._get_schema(tool, "function_json", function_to_json)
+
+    def _get_schema(
+        self, tool: Callable, kind: str, create: Callable[[Callable], dict]
+    ) -> dict:
+        with self._lock:
+            schema = self._schemas.get(tool, {}).get(kind)
+            if schema is not None:
+                self.hits += 1
+                return schema
+            self.misses += 1
+        schema = create(tool)
+        try:
+            with self._lock:
+                self._schemas.setdefault(tool, {})[kind] = schema
+        except TypeError:
+            # Some callables, e.g. builtins, cannot be weakly referenced, so they are not cached.
+            pass
+        return schema
+
+    def cache_info(self) -> ToolRegistryInfo:
+        """Report the hit and miss counts, like `functools.lru_cache`."""
+        with self._lock:
+            return ToolRegistryInfo(self.hits, self.misses, len(self._schemas))
+
+    def cache_clear(self) -> None:
+        """Remove all schemas and reset the statistics."""
+        with self._lock:
+            self._schemas.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def _create_tool_definition(tool: Callable) -> dict:
+    return {"type": "function", "function": convert_to_openai_function(tool)}
+
+
+# The schemas of all tools of this process.
+tool_registry = ToolRegistry()
+
 
 def execute_tool(
     tool_name: str, tool_args: Dict[str, Any], available_tools: Dict[str, Callable]
 ) -> str:
     """Executes a tool and returns the response as a JSON string."""
     if tool_name not in available_tools:
-        error_message = {
-            "error": f"Tool '{tool_name}' not found. Available tools: {list(available_tools.keys())}"
-        }
-        logging.error(error_message["error"])
-        return json.dumps(error_message)
+        return _tool_error(
+            f"Tool '{tool_name}' not found. Available tools: {list(available_tools.keys())}"
+        )
+
+    try:
+        tool = available_tools[tool_name]
+        if inspect.iscoroutinefunction(tool):
+            # The pool threads do not have an event loop, so the tool runs on the shared one.
+            future = asyncio.run_coroutine_threadsafe(
+                tool(**tool_args), get_tool_event_loop()
+            )
+            return json.dumps(future.result())
+        return json.dumps(tool(**tool_args))
+    except Exception as e:
+        logging.error(f"Error executing tool '{tool_name}': {e}")
+        return json.dumps({"error": str(e)})
+
+
+def execute_tools(
+    tool_calls: list[dict],
+    available_tools: Dict[str, Callable],
+    timeout: float | Dict[str, float] = DEFAULT_TOOL_TIMEOUT,
+) -> list[str]:
+    """
+    Execute the tool calls of one model response at the same time, e.g. the stock prices of three companies.
+    :param tool_calls: The tool calls, each with the `name` and the `args` of the tool.
+    :param available_tools: The tools by name.
+    :param timeout: The max seconds per tool call, or the max seconds per tool name,
+        tools that are not in it get `DEFAULT_TOOL_TIMEOUT`.
+    :return: The JSON responses of the tools, in the order of the tool calls, so the messages stay deterministic.
+    """
+    start = time.monotonic()
+    futures = [
+        tool_executor.submit(
+            execute_tool, tool_call["name"], tool_call["args"], available_tools
+        )
+        for tool_call in tool_calls
+    ]
 
+    tool_responses = []
+    for tool_call, future in zip(tool_calls, futures):
+        tool_timeout = _get_tool_timeout(timeout, tool_call["name"])
+        # All calls started at the same time, so each one waits until its own deadline.
+        remaining = max(start + tool_timeout - time.monotonic(), 0.0)
+        try:
+            tool_responses.append(future.result(timeout=remaining))
+        except TimeoutError:
+            future.cancel()
+            tool_responses.append(_tool_timeout_error(tool_call["name"], tool_timeout))
+    return tool_responses
+
+
+async def aexecute_tool(
+    tool_name: str,
+    tool_args: Dict[str, Any],
+    available_tools: Dict[str, Callable],
+    timeout: float | Dict[str, float] = DEFAULT_TOOL_TIMEOUT,
+) -> str:
+    """
+    Executes a tool from async code and returns the response as a JSON string.
+    Async tools are awaited and cancelled when they time out, other tools run in `tool_executor`.
+    """
+    tool = available_tools.get(tool_name)
+    tool_timeout = _get_tool_timeout(timeout, tool_name)
     try:
-        return json.dumps(available_tools[tool_name](**tool_args))
+        if inspect.iscoroutinefunction(tool):
+            result = await asyncio.wait_for(tool(**tool_args), tool_timeout)
+            return json.dumps(result)
+        return await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(
+                tool_executor, execute_tool, tool_name, tool_args, available_tools
+            ),
+            tool_timeout,
+        )
+    except TimeoutError:
+        return _tool_timeout_error(tool_name, tool_timeout)
     except Exception as e:
         logging.error(f"Error executing tool '{tool_name}': {e}")
         return json.dumps({"error": str(e)})
 
 
+def _get_tool_timeout(timeout: float | Dict[str, float], tool_name: str) -> float:
+    if isinstance(timeout, dict):
+        return timeout.get(tool_name, DEFAULT_TOOL_TIMEOUT)
+    return timeout
+
+
+def _tool_timeout_error(tool_name: str, timeout: float) -> str:
+    return _tool_error(f"Tool '{tool_name}' timed out after {timeout} seconds")
+
+
+def _tool_error(error_message: str) -> str:
+    logging.error(error_message)
+    return json.dumps({"error": error_message})
+
+
 def tool_calling_agent(
     client,
     system_prompt: str,
@@ -43,22 +250,16 @@ def tool_calling_agent(
     temperature: float = 0.0,
     iterations: int = 3,
     seed: int = 0,
+    tool_timeout: float | Dict[str, float] = DEFAULT_TOOL_TIMEOUT,
 ) -> str:
-    """Generates a response using AI and invokes available tools if necessary."""
-
-    tool_definitions = [
-        {"type": "function", "function": convert_to_openai_function(tool)}
-        for tool in tools
-    ]
-    available_tools = {tool.__name__: tool for tool in tools}
-
-    if react:
-        system_prompt += get_react_prompt(tools)  # Use updated ReAct prompt
+    """
+    Generates a response using AI and invokes available tools if necessary.
+    The tool calls of one response are executed at the same time, see `execute_tools`.
+    """
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-    ]
+    tool_definitions, available_tools, messages = _prepare_agent(
+        system_prompt, user_prompt, tools, react
+    )
 
     output_logs = []
 
@@ -79,14 +280,14 @@ def tool_calling_agent(
         if not tool_calls:
             break  # No tools needed, exit loop
 
+        # Step 3: Execute the tools and capture their responses
+        tool_outputs = execute_tools(tool_calls, available_tools, timeout=tool_timeout)
+
         tool_responses = []
-        for tool_call in tool_calls:
+        for tool_call, tool_response in zip(tool_calls, tool_outputs):
             tool_name = tool_call["name"]
             tool_args = tool_call["args"]
 
-            # Step 3: Execute the tool and capture response
-            tool_response = execute_tool(tool_name, tool_args, available_tools)
-
             # Log tool execution
             output_logs.append(
                 f"\n### Tool Called: {tool_name} with args: {tool_args}\n"
@@ -110,9 +311,105 @@ def tool_calling_agent(
     return "".join(output_logs)
 
 
+async def run_agent(
+    client,
+    system_prompt: str,
+    user_prompt: str,
+    *tools: Callable,
+    react: bool = False,
+    temperature: float = 0.0,
+    iterations: int = 3,
+    seed: int = 0,
+    tool_timeout: float | Dict[str, float] = DEFAULT_TOOL_TIMEOUT,
+) -> AsyncIterator[AgentEvent]:
+    """
+    The async version of `tool_calling_agent`, which reports every step as soon as it happens,
+    e.g. `async for event in run_agent(client, system_prompt, user_prompt, get_stock_prices): ...`.
+    The model is called with `ainvoke` and async tools are awaited, so many agents can run on one event loop.
+    :param client: The chat model.
+    :param system_prompt: The system prompt.
+    :param user_prompt: The question of the user.
+    :param tools: The functions the model may call.
+    :param react: Whether to add the ReAct prompt to the system prompt.
+    :param temperature: The temperature of the model.
+    :param iterations: The max number of model calls.
+    :param seed: The seed of the model.
+    :param tool_timeout: The max seconds per tool call, or per tool name.
+    :return: The events: the output of every model call, the start and the result of every tool call,
+        and finally the final answer, or `max_iterations` if the agent did not finish.
+    """
+    tool_definitions, available_tools, messages = _prepare_agent(
+        system_prompt, user_prompt, tools, react
+    )
+
+    for i in range(iterations):
+        response = await client.ainvoke(
+            input=messages, tools=tool_definitions, seed=seed, temperature=temperature
+        )
+        messages.append(response)
+        yield AgentEvent("model_output", response.content)
+
+        tool_calls = response.tool_calls
+        if "Final Answer:" in response.content or not tool_calls:
+            yield AgentEvent("final_answer", response.content)
+            return
+
+        async def execute(tool_call: dict) -> tuple[dict, str]:
+            tool_response = await aexecute_tool(
+                tool_call["name"], tool_call["args"], available_tools, tool_timeout
+            )
+            return tool_call, tool_response
+
+        for tool_call in tool_calls:
+            yield AgentEvent("tool_start", "", tool_call["name"], tool_call["args"])
+        # The results are reported as they arrive, but added to the messages in the order of the calls.
+        tool_responses = {}
+        for next_result in asyncio.as_completed(
+            [execute(tool_call) for tool_call in tool_calls]
+        ):
+            tool_call, tool_response = await next_result
+            tool_responses[id(tool_call)] = tool_response
+            yield AgentEvent(
+                "tool_result", tool_response, tool_call["name"], tool_call["args"]
+            )
+        messages.extend(
+            {
+                "role": "assistant",  # Keep it within the ReAct format
+                "content": f"Observation: {tool_responses[id(tool_call)]}",
+            }
+            for tool_call in tool_calls
+        )
+
+    yield AgentEvent(
+        "max_iterations", "Maximum iterations reached. Stopping further tool calls."
+    )
+
+
+def _prepare_agent(
+    system_prompt: str, user_prompt: str, tools: tuple[Callable, ...], react: bool
+) -> tuple[list[dict], Dict[str, Callable], list]:
+    tool_definitions = [tool_registry.get_tool_definition(tool) for tool in tools]
+    available_tools = {tool.__name__: tool for tool in tools}
+
+    if react:
+        system_prompt += get_react_prompt(tools)  # Use updated ReAct prompt
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    return tool_definitions, available_tools, messages
+
+
 def get_react_prompt(tools):
     """Generates a ReAct-style prompt for decision-making."""
-    tool_names = [tool.__name__ for tool in tools]
+    return _get_react_prompt(tuple(tool.__name__ for tool in tools))
+
+
+@lru_cache(maxsize=256)
+def _get_react_prompt(tool_names: tuple[str, ...]) -> str:
+    # The prompt only depends on the names of the tools, so it is built once per set of tools.
+    tool_names = list(tool_names)
 
     return f"""
 Answer the following questions as best you can.
@@ -155,7 +452,8 @@ def extract_params(doc_str: str):
 
 def function_to_json(func):
     """Convert a Python function into the JSON format expected by the model."""
-    argspec = inspect.getfullargspec(func)
+    # Look through decorators such as `ttl_cache`, which take any arguments.
+    argspec = inspect.getfullargspec(inspect.unwrap(func))
     function_doc = inspect.getdoc(func) or ""
 
     param_details = extract_params(function_doc)
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only a single process can safely append.
+    fcntl = None
+
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get(
+        "EMBEDDING_CACHE_DIR",
+        Path.home() / ".cache" / "llm_in_production" / "embeddings",
+    )
+)
+
+
+def hash_text(text: str) -> str:
+    """
+    Hash a text such that identical texts get the same key.
+    :param text: The text to hash.
+    :return: A hex digest of the text.
+    """
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+class EmbeddingStore:
+    """
+    An append-only store of float32 embeddings for a single model.
+
+    The vectors live in a raw `vectors.f32` file that is memory-mapped for reading,
+    and the key of every row is appended to `keys.txt`. The vectors are written before their keys,
+    so a row is only visible once it is complete. Appends from multiple processes are serialized
+    with a file lock, so notebooks and apps can share the same store.
+    """
+
+    def __init__(self, path: Path):
+        """
+        :param path: The directory of the store.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self.path / "vectors.f32"
+        self._keys_path = self.path / "keys.txt"
+        self._meta_path = self.path / "meta.json"
+        self._lock = threading.Lock()
+        self._rows: dict[str, int] = {}
+        self._keys_offset = 0
+        self._dim: int | None = None
+        self._vectors: np.ndarray | None = None
+        if self._meta_path.exists():
+            self._dim = json.loads(self._meta_path.read_text())["dim"]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._rows)
+
+    def get(self, keys: list[str]) -> list[np.ndarray | None]:
+        """
+        Look up the vectors of the given keys.
+        :param keys: The keys to look up.
+        :return: The vector of every key, or None if the key is not in the store.
+        """
+        with self._lock:
+            self._refresh()
+            return [
+                self._vectors[self._rows[key]] if key in self._rows else None
+                for key in keys
+            ]
+
+    def add(self, keys: list[str], vectors: np.ndarray) -> None:
+        """
+        Append vectors to the store. Keys that are already stored are skipped.
+        :param keys: The keys of the vectors.
+        :param vectors: The vectors of shape (n_keys, dim).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, open(self.path / ".lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another process may have appended in the meantime.
+            self._refresh()
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                self._meta_path.write_text(json.dumps({"dim": self._dim}))
+            if vectors.shape[1] != self._dim:
+                raise ValueError(
+                    f"Expected vectors of dimension {self._dim} but got {vectors.shape[1]}"
+                )
+
+            new_rows = {}
+            for row, key in enumerate(keys):
+                if key not in self._rows and key not in new_rows:
+                    new_rows[key] = row
+            if not new_rows:
+                return
+
+            # Drop a partially written row of a process that crashed, before appending.
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(len(self._rows) * self._dim * 4)
+                f.write(vectors[list(new_rows.values())].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._keys_path, "a") as f:
+                f.write("".join(f"{key}\n" for key in new_rows))
+            self._refresh()
+
+    def _refresh(self) -> None:
+        # Read the keys that were appended since the last refresh and re-map the vectors if needed.
+        if not self._keys_path.exists():
+            return
+        with open(self._keys_path, "r") as f:
+            f.seek(self._keys_offset)
+            new_keys = f.read()
+        # Only consume complete lines; a concurrent writer may be halfway through a line.
+        new_keys = new_keys[: new_keys.rfind("\n") + 1]
+        if not new_keys:
+            return
+        self._keys_offset += len(new_keys.encode())
+        for key in new_keys.splitlines():
+            self._rows[key] = len(self._rows)
+        if self._dim is None:
+            self._dim = json.loads(self._meta_path.read_text())["dim"]
+        self._vectors = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r",
+            shape=(len(self._rows), self._dim),
+        )
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a content-addressed, on-disk embedding cache.
+    Texts are keyed by the model name and a hash of the text, so the same text is only embedded once,
+    no matter which notebook or app asked for it. All cache misses of a call are embedded in one batch.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        cache_dir: Path = DEFAULT_CACHE_DIR,
+        cache_queries: bool = False,
+    ):
+        """
+        :param embeddings: The embedding model, e.g. `HuggingFaceEmbeddings`.
+        :param model_name: The name of the model, used to keep the vectors of different models apart.
+        :param cache_dir: The directory that holds the stores of all models.
+        :param cache_queries: Whether to also cache `embed_query`. Some models embed queries differently from documents.
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_queries = cache_queries
+        self.store = EmbeddingStore(
+            Path(cache_dir) / re.sub(r"[^\w.-]", "_", model_name)
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed a list of texts, only sending the texts that are not cached yet to the model.
+        :param texts: The texts to embed.
+        :return: The embeddings, in the same order as `texts`.
+        """
+        keys = [hash_text(text) for text in texts]
+        vectors = self.store.get(keys)
+
+        missing = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing[key] = text
+        self.hits += len(texts) - sum(vector is None for vector in vectors)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = np.asarray(
+                self.embeddings.embed_documents(list(missing.values())),
+                dtype=np.float32,
+            )
+            self.store.add(list(missing.keys()), new_vectors)
+            new_vectors_by_key = dict(zip(missing.keys(), new_vectors))
+            vectors = [
+                new_vectors_by_key[key] if vector is None else vector
+                for key, vector in zip(keys, vectors)
+            ]
+
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> list[float]:
+        """
+        Embed a single query.
+        :param text: The query to embed.
+        :return: The embedding of the query.
+        """
+        if not self.cache_queries:
+            return self.embeddings.embed_query(text)
+        return self.embed_documents([text])[0]
@@ -0,0 +1,56 @@
+import asyncio
+import random
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A local chat model for benchmarks and experiments without an API key.
+    It echoes the last message after a latency, which can have a slow tail, and can reject requests with a 429.
+    """
+
+    latency: float = 0.2
+    tail_latency: float = 0.0
+    tail_probability: float = 0.0
+    rate_limit_probability: float = 0.0
+    error_probability: float = 0.0
+    prefix: str = ""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._sample_latency())
+        self._maybe_fail()
+        return self._echo(messages)
+
+    async def _agenerate(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> ChatResult:
+        await asyncio.sleep(self._sample_latency())
+        self._maybe_fail()
+        return self._echo(messages)
+
+    def _sample_latency(self) -> float:
+        if random.random() < self.tail_probability:
+            return self.tail_latency
+        return self.latency
+
+    def _maybe_fail(self) -> None:
+        if random.random() < self.rate_limit_probability:
+            raise FakeRateLimitError("Too many requests")
+        if random.random() < self.error_probability:
+            raise RuntimeError("The backend is unavailable")
+
+    def _echo(self, messages) -> ChatResult:
+        message = AIMessage(content=self.prefix + messages[-1].content)
+        return ChatResult(generations=[ChatGeneration(message=message)])
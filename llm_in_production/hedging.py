@@ -0,0 +1,186 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import Field, PrivateAttr
+
+from llm_in_production.instrumentation import find_call_site
+
+# The threads that run the sync calls to the backends, shared by all hedged models of this process.
+# A request that lost the race keeps its thread until it finishes, so there are more threads than backends.
+hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedged-backend")
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    A chat model that sends each call to several backends, e.g. the same model on Azure and OpenAI,
+    to cut the slow tail of the latency and to survive the outage of a provider.
+
+    The call goes to the backend with the lowest average latency first. If it has not answered within
+    `hedge_delay` seconds, the same call is also sent to the next backend, and the first answer that
+    arrives is used while the other request is cancelled. If a backend fails, the next one is tried.
+    The latency of every backend is tracked with an exponentially weighted moving average (EWMA).
+    """
+
+    backends: list[BaseChatModel] = Field(min_length=1)
+    # The time to wait for an answer before hedging, e.g. the p95 latency of the fastest backend
+    # as reported by `instrumentation.call_records.summary()`, so only the slowest 5% are hedged.
+    hedge_delay: float = 2.0
+    # The max number of requests in flight for a single call.
+    max_parallel: int = 2
+    # The weight of the latest latency in the moving average.
+    ewma_alpha: float = 0.2
+    # The latency that is recorded for a backend that failed, so it is tried last for a while.
+    failure_penalty: float = 30.0
+
+    _latencies: dict[int, float] = PrivateAttr(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-chat-model"
+
+    def backend_latencies(self) -> list[float | None]:
+        """
+        Get the moving average of the latency of every backend.
+        :return: The latency in seconds per backend, in the order of `backends`, or None if it was never called.
+        """
+        with self._lock:
+            return [self._latencies.get(i) for i in range(len(self.backends))]
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        config = self._get_child_config(run_manager)
+        order = iter(self._get_order())
+        # A request that is running in a thread cannot be interrupted, so the slower one is abandoned
+        # and its thread finishes in the background. Use `ainvoke` to really cancel it.
+        pending: dict[Future, tuple[int, float]] = {}
+
+        def start_next() -> None:
+            index = next(order, None)
+            if index is not None:
+                context = contextvars.copy_context()
+                future = hedge_executor.submit(
+                    context.run,
+                    self.backends[index].invoke,
+                    messages,
+                    config,
+                    stop=stop,
+                    **kwargs,
+                )
+                pending[future] = (index, time.perf_counter())
+
+        last_error = None
+        try:
+            start_next()
+            while pending:
+                done, _ = wait(
+                    pending, timeout=self.hedge_delay, return_when=FIRST_COMPLETED
+                )
+                if not done and len(pending) < self.max_parallel:
+                    start_next()
+                for future in done:
+                    index, start = pending.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        self._update_latency(index, time.perf_counter() - start)
+                        return _to_chat_result(future.result())
+                    self._update_latency(index, self.failure_penalty)
+                    last_error = error
+                    start_next()
+        finally:
+            self._abandon(pending.values())
+            for future in pending:
+                future.cancel()
+        raise last_error
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        config = self._get_child_config(run_manager)
+        order = iter(self._get_order())
+        pending: dict[asyncio.Task, tuple[int, float]] = {}
+
+        def start_next() -> None:
+            index = next(order, None)
+            if index is not None:
+                task = asyncio.create_task(
+                    self.backends[index].ainvoke(messages, config, stop=stop, **kwargs)
+                )
+                pending[task] = (index, time.perf_counter())
+
+        last_error = None
+        try:
+            start_next()
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=self.hedge_delay, return_when=FIRST_COMPLETED
+                )
+                if not done and len(pending) < self.max_parallel:
+                    start_next()
+                for task in done:
+                    index, start = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        self._update_latency(index, time.perf_counter() - start)
+                        return _to_chat_result(task.result())
+                    self._update_latency(index, self.failure_penalty)
+                    last_error = error
+                    start_next()
+        finally:
+            self._abandon(pending.values())
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+    def _get_order(self) -> list[int]:
+        # Backends without a measurement come first, so every backend gets measured.
+        latencies = self.backend_latencies()
+        return sorted(
+            range(len(self.backends)),
+            key=lambda i: -1.0 if latencies[i] is None else latencies[i],
+        )
+
+    def _get_child_config(self, run_manager) -> dict[str, Any]:
+        # The backends run in other threads or tasks, where the caller is no longer on the stack,
+        # so pass on the call site that this call got, e.g. from `batch_invoke`, or find it now.
+        metadata = run_manager.metadata if run_manager is not None else {}
+        return {
+            "metadata": {"call_site": metadata.get("call_site") or find_call_site()}
+        }
+
+    def _update_latency(self, index: int, latency: float) -> None:
+        with self._lock:
+            previous = self._latencies.get(index)
+            self._latencies[index] = (
+                latency
+                if previous is None
+                else self.ewma_alpha * latency + (1 - self.ewma_alpha) * previous
+            )
+
+    def _abandon(self, requests) -> None:
+        # A request that lost the race took at least this long, which only says something if it is slower than usual.
+        now = time.perf_counter()
+        for index, start in requests:
+            latency = self.backend_latencies()[index]
+            if latency is None or now - start > latency:
+                self._update_latency(index, now - start)
+
+
+def _to_chat_result(message: BaseMessage) -> ChatResult:
+    return ChatResult(generations=[ChatGeneration(message=message)])
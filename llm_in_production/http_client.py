@@ -0,0 +1,143 @@
+import asyncio
+import random
+import time
+import weakref
+from functools import cache
+from typing import Any, AsyncIterator
+
+import httpx
+
+# The web APIs of the agent tools answer within seconds, so a hung API fails the tool call instead of the agent.
+# With `TOOL_HTTP_MAX_RETRIES`, the worst case is 3 attempts of 2 + 5 s and 0.75 + 1.5 s of backoff, about 23.5 s,
+# so the retries fit within the 30 s of `agent_utils.DEFAULT_TOOL_TIMEOUT` and the agent gets the last error.
+TOOL_HTTP_TIMEOUT = httpx.Timeout(5.0, connect=2.0)
+TOOL_HTTP_MAX_RETRIES = 2
+# Keep-alive connections are reused for a minute, so a tool call does not pay for DNS and a TLS handshake.
+TOOL_HTTP_LIMITS = httpx.Limits(
+    max_connections=50, max_keepalive_connections=20, keepalive_expiry=60
+)
+# The status codes of errors that usually go away when the request is sent again.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+@cache
+def get_http_client() -> httpx.Client:
+    """
+    Get the HTTP client that is shared by all agent tools of this process.
+    :return: The client, with a pool of keep-alive connections and timeouts.
+    """
+    return httpx.Client(
+        timeout=TOOL_HTTP_TIMEOUT, limits=TOOL_HTTP_LIMITS, follow_redirects=True
+    )
+
+
+# An async client can only be used on the event loop that it was first used on.
+# The generator that closes the client is kept with it, see `get_async_http_client`.
+_async_http_clients: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, tuple[httpx.AsyncClient, AsyncIterator[None]]
+] = weakref.WeakKeyDictionary()
+
+
+async def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Get the async HTTP client that is shared by all agent tools on the running event loop.
+    The client is closed when the loop shuts down, e.g. at the end of `asyncio.run`, as its connections
+    keep a reference to the loop, which would otherwise keep both alive after every `asyncio.run`.
+    :return: The client, with a pool of keep-alive connections and timeouts.
+    """
+    loop = asyncio.get_running_loop()
+    if loop in _async_http_clients:
+        return _async_http_clients[loop][0]
+
+    client = httpx.AsyncClient(
+        timeout=TOOL_HTTP_TIMEOUT, limits=TOOL_HTTP_LIMITS, follow_redirects=True
+    )
+    # `asyncio.run` closes the async generators of its loop before it closes the loop,
+    # which is the only hook to run async code at the end of a loop.
+    closer = _close_at_loop_shutdown(loop, client)
+    await anext(closer)
+    _async_http_clients[loop] = client, closer
+    return client
+
+
+async def _close_at_loop_shutdown(
+    loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient
+) -> AsyncIterator[None]:
+    try:
+        yield
+    finally:
+        _async_http_clients.pop(loop, None)
+        await client.aclose()
+
+
+def get_json(
+    url: str,
+    params: dict[str, Any] | None = None,
+    max_retries: int = TOOL_HTTP_MAX_RETRIES,
+    initial_delay: float = 0.5,
+    max_delay: float = 5.0,
+) -> Any:
+    """
+    Get a JSON document from a web API over the shared connection pool.
+    Connection errors, timeouts and the status codes in `RETRY_STATUS_CODES` are retried, and raised
+    when the retries run out, so e.g. `ttl_cache` does not cache a transient error as a result.
+    :param url: The URL.
+    :param params: The query parameters.
+    :param max_retries: The max number of times the request is sent again.
+    :param initial_delay: The delay in seconds before the first retry, it doubles with every retry.
+    :param max_delay: The max delay in seconds between two retries.
+    :return: The JSON body of the response, also for an error that is not retried, so the model can read its message.
+        An error without a JSON body, e.g. the HTML page of a proxy, is returned as its status code and text.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            response = get_http_client().get(url, params=params)
+            if response.status_code not in RETRY_STATUS_CODES:
+                return _read_json(response)
+            if attempt == max_retries:
+                response.raise_for_status()
+        except httpx.TransportError:
+            if attempt == max_retries:
+                raise
+        time.sleep(_get_retry_delay(attempt, initial_delay, max_delay))
+
+
+async def aget_json(
+    url: str,
+    params: dict[str, Any] | None = None,
+    max_retries: int = TOOL_HTTP_MAX_RETRIES,
+    initial_delay: float = 0.5,
+    max_delay: float = 5.0,
+) -> Any:
+    """The async version of `get_json`, for tools of the async agent."""
+    for attempt in range(max_retries + 1):
+        try:
+            client = await get_async_http_client()
+            response = await client.get(url, params=params)
+            if response.status_code not in RETRY_STATUS_CODES:
+                return _read_json(response)
+            if attempt == max_retries:
+                response.raise_for_status()
+        except httpx.TransportError:
+            if attempt == max_retries:
+                raise
+        await asyncio.sleep(_get_retry_delay(attempt, initial_delay, max_delay))
+
+
+def _read_json(response: httpx.Response) -> Any:
+    try:
+        return response.json()
+    except ValueError:
+        if not response.is_error:
+            # Without the query, as it contains the API key.
+            raise ValueError(
+                f"Expected JSON from {response.url.copy_with(query=None)}, got: {response.text[:200]!r}"
+            ) from None
+        # Truncated, as e.g. the HTML error page of a proxy would fill the context of the model.
+        return {"status_code": response.status_code, "message": response.text[:500]}
+
+
+def _get_retry_delay(attempt: int, initial_delay: float, max_delay: float) -> float:
+    # With jitter, so the retries of concurrent calls do not hit the API at the same time.
+    delay = min(initial_delay * 2**attempt, max_delay)
+    return delay * random.uniform(0.5, 1.5)
@@ -1,8 +1,28 @@
-import torch
-from transformers import GPT2LMHeadModel, GPT2Tokenizer
+from __future__ import annotations
 
+import functools
+from typing import TYPE_CHECKING, Callable
 
-@torch.no_grad()  # disable gradient tracking
+# Importing torch and transformers takes seconds, so they are only imported when a function is called.
+if TYPE_CHECKING:
+    import torch
+    from transformers import GPT2LMHeadModel, GPT2Tokenizer
+
+
+def _no_grad(function: Callable) -> Callable:
+    """Like `@torch.no_grad()`, but torch is only imported when the function is called."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        import torch
+
+        with torch.no_grad():
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+@_no_grad  # disable gradient tracking
 def get_probs_next_word_top_k(
     tokenizer: GPT2Tokenizer,
     model: GPT2LMHeadModel,
@@ -49,10 +69,12 @@ def softmax_with_temperature(
     :param dim: The dimension to apply the softmax on.
     :return: The softmaxed tensor.
     """
+    import torch
+
     return torch.softmax(x / (temperature + eps), dim=dim)
 
 
-@torch.no_grad()  # disable gradient tracking
+@_no_grad  # disable gradient tracking
 def get_probs_next_word_top_p(
     tokenizer: GPT2Tokenizer,
     model: GPT2LMHeadModel,
@@ -70,6 +92,8 @@ def get_probs_next_word_top_p(
     :param temperature: The temperature to use for the softmax, the higher the more random the output.
     :return: A tuple of the top words and their probabilities.
     """
+    import torch
+
     # Encode the text using the tokenizer
     tokens = tokenizer.encode_plus(text, return_tensors="pt")
 
@@ -102,6 +126,8 @@ def get_probs_next_word_top_p(
 
 
 def get_device() -> str:
+    import torch
+
     if torch.cuda.is_available():
         devices = "cuda"
     elif torch.backends.mps.is_available():
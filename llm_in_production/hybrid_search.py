@@ -0,0 +1,221 @@
+import json
+import math
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+BM25_FILE_NAME = "bm25.json"
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split a text into lowercase word tokens, e.g. "scikit-learn" becomes ["scikit", "learn"].
+    :param text: The text to tokenize.
+    :return: The tokens.
+    """
+    return re.findall(r"\w+", text.lower())
+
+
+class BM25Index:
+    """
+    A keyword index that scores documents with Okapi BM25.
+
+    Dense embeddings are good at matching meaning, but often miss exact names such as
+    speakers or libraries. BM25 scores exact term matches, weighted by how rare the term is.
+    The index is inverted: for every term it stores which documents contain it and how often,
+    so a query only touches the documents that share at least one term with it.
+    """
+
+    def __init__(
+        self,
+        ids: list[str],
+        postings: dict[str, tuple[np.ndarray, np.ndarray]],
+        doc_lengths: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        """
+        :param ids: The id of every document.
+        :param postings: For every term, the positions of the documents that contain it and the term frequencies.
+        :param doc_lengths: The number of tokens in every document.
+        :param k1: How quickly the score saturates when a term occurs more often.
+        :param b: How strongly long documents are penalized.
+        """
+        self.ids = ids
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self._avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def from_texts(cls, texts: list[str], ids: list[str], **kwargs) -> "BM25Index":
+        """
+        Build the index.
+        :param texts: The text of every document.
+        :param ids: The id of every document.
+        :return: The BM25 index.
+        """
+        postings = defaultdict(lambda: ([], []))
+        doc_lengths = []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings[term][0].append(position)
+                postings[term][1].append(frequency)
+
+        postings = {
+            term: (np.array(positions, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            for term, (positions, tfs) in postings.items()
+        }
+        return cls(
+            list(ids), postings, np.array(doc_lengths, dtype=np.float32), **kwargs
+        )
+
+    @classmethod
+    def from_faiss(cls, db, **kwargs) -> "BM25Index":
+        """
+        Build the index over the same chunks as a LangChain FAISS vector store.
+        :param db: The FAISS vector store.
+        :return: The BM25 index.
+        """
+        ids = [db.index_to_docstore_id[i] for i in range(len(db.index_to_docstore_id))]
+        texts = [db.docstore.search(id_).page_content for id_ in ids]
+        return cls.from_texts(texts, ids, **kwargs)
+
+    def search(self, query: str, k: int = 10) -> list[tuple[str, float]]:
+        """
+        Find the documents with the highest BM25 score for the query.
+        :param query: The query.
+        :param k: The number of results.
+        :return: The ids and scores of the best documents, best first. Documents without any matching term are left out.
+        """
+        if k <= 0:
+            return []
+        n_documents = len(self.ids)
+        scores = np.zeros(n_documents, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            positions, term_frequencies = self.postings[term]
+            idf = math.log(
+                1 + (n_documents - len(positions) + 0.5) / (len(positions) + 0.5)
+            )
+            length_norm = (
+                1
+                - self.b
+                + self.b * self.doc_lengths[positions] / max(self._avg_doc_length, 1e-9)
+            )
+            scores[positions] += (
+                idf
+                * term_frequencies
+                * (self.k1 + 1)
+                / (term_frequencies + self.k1 * length_norm)
+            )
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in matches]
+
+    def save(self, folder_path: Path) -> None:
+        """
+        Save the index next to a vector store.
+        :param folder_path: The folder to save the index to.
+        """
+        data = {
+            "ids": self.ids,
+            "doc_lengths": self.doc_lengths.tolist(),
+            "k1": self.k1,
+            "b": self.b,
+            "postings": {
+                term: [positions.tolist(), tfs.tolist()]
+                for term, (positions, tfs) in self.postings.items()
+            },
+        }
+        with open(Path(folder_path) / BM25_FILE_NAME, "w") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, folder_path: Path) -> "BM25Index":
+        """
+        Load an index that was saved with `save`.
+        :param folder_path: The folder the index was saved to.
+        :return: The BM25 index.
+        """
+        with open(Path(folder_path) / BM25_FILE_NAME, "r") as f:
+            data = json.load(f)
+        postings = {
+            term: (np.array(positions, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            for term, (positions, tfs) in data["postings"].items()
+        }
+        return cls(
+            data["ids"],
+            postings,
+            np.array(data["doc_lengths"], dtype=np.float32),
+            k1=data["k1"],
+            b=data["b"],
+        )
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[str]], k: int = 60
+) -> list[tuple[str, float]]:
+    """
+    Fuse several rankings into one. Every document gets 1 / (k + rank) for each ranking it appears in.
+    Only the ranks are used, so the scores of the retrievers do not have to be comparable.
+    :param rankings: The ranked ids of every retriever, best first.
+    :param k: Dampens the influence of the top ranks, 60 is the value from the original paper.
+    :return: The fused ids and scores, best first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, start=1):
+            scores[id_] += 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_search(
+    db,
+    bm25_index: BM25Index,
+    query: str,
+    k: int = 4,
+    k_dense: int = 10,
+    k_sparse: int = 10,
+    rrf_k: int = 60,
+    query_vector: list[float] | None = None,
+) -> list[Document]:
+    """
+    Search with both the dense vector store and the BM25 index and fuse the results.
+    :param db: The LangChain vector store, e.g. FAISS.
+    :param bm25_index: The BM25 index over the same chunks.
+    :param query: The query.
+    :param k: The number of results to return.
+    :param k_dense: The number of candidates from the vector store.
+    :param k_sparse: The number of candidates from the BM25 index.
+    :param rrf_k: The constant of the reciprocal rank fusion.
+    :param query_vector: The embedding of the query, if it was already embedded, e.g. for a semantic cache.
+    :return: The fused documents, best first.
+    """
+    documents = {}
+    dense_ids = []
+    if k_dense > 0:
+        if query_vector is None:
+            dense_documents = db.similarity_search(query, k=k_dense)
+        else:
+            dense_documents = db.similarity_search_by_vector(query_vector, k=k_dense)
+        for document in dense_documents:
+            documents[document.id] = document
+            dense_ids.append(document.id)
+    sparse_ids = [id_ for id_, _ in bm25_index.search(query, k=k_sparse)]
+
+    fused = reciprocal_rank_fusion([dense_ids, sparse_ids], k=rrf_k)[:k]
+    missing_ids = [id_ for id_, _ in fused if id_ not in documents]
+    for document in db.get_by_ids(missing_ids):
+        documents[document.id] = document
+    return [documents[id_] for id_, _ in fused if id_ in documents]
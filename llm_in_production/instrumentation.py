@@ -0,0 +1,353 @@
+import contextvars
+import dataclasses
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import Any, Protocol
+from uuid import UUID
+
+import httpx
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from llm_in_production.response_cache import CACHE_HIT_HEADER
+
+# Frames of these modules are skipped when looking for the code that called the LLM.
+_INTERNAL_MODULES = (
+    "langchain",
+    "langsmith",
+    "openai",
+    "httpx",
+    "asyncio",
+    "concurrent",
+    "threading",
+    "llm_in_production.llm",
+    "llm_in_production.hedging",
+    "llm_in_production.streaming",
+    "llm_in_production.instrumentation",
+)
+
+
+@dataclass
+class CallRecord:
+    """The measurements of a single LLM call."""
+
+    call_site: str
+    model: str | None = None
+    start_time: float = 0.0
+    wall_time: float = 0.0
+    queue_time: float = 0.0
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    n_requests: int = 0
+    cache_hit: bool = False
+    error: str | None = None
+
+    @property
+    def retries(self) -> int:
+        return max(self.n_requests - 1, 0)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**dataclasses.asdict(self), "retries": self.retries}
+
+
+class CallRecordSink(Protocol):
+    def emit(self, record: CallRecord) -> None:
+        ...
+
+
+class RingBufferSink:
+    """Keeps the most recent call records in memory, e.g. to show them in a dashboard."""
+
+    def __init__(self, maxlen: int = 1000):
+        """
+        :param maxlen: The max number of records to keep.
+        """
+        self._records: deque[CallRecord] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def emit(self, record: CallRecord) -> None:
+        with self._lock:
+            self._records.append(record)
+
+    def records(self) -> list[CallRecord]:
+        with self._lock:
+            return list(self._records)
+
+    def summary(self) -> list[dict[str, Any]]:
+        """
+        Summarize the records per call site.
+        :return: For every call site, the number of calls, the p50 and p95 wall and queue times,
+            the mean number of tokens and the fraction of retried and cached calls.
+        """
+        by_call_site: dict[str, list[CallRecord]] = {}
+        for record in self.records():
+            by_call_site.setdefault(record.call_site, []).append(record)
+
+        rows = []
+        for call_site, records in sorted(by_call_site.items()):
+            wall_times = np.array([record.wall_time for record in records])
+            queue_times = np.array([record.queue_time for record in records])
+            completion_tokens = [
+                record.completion_tokens
+                for record in records
+                if record.completion_tokens is not None
+            ]
+            rows.append(
+                {
+                    "call_site": call_site,
+                    "calls": len(records),
+                    "p50_s": float(np.percentile(wall_times, 50)),
+                    "p95_s": float(np.percentile(wall_times, 95)),
+                    "p95_queue_s": float(np.percentile(queue_times, 95)),
+                    "completion_tokens": (
+                        float(np.mean(completion_tokens)) if completion_tokens else None
+                    ),
+                    "retried": float(
+                        np.mean([record.retries > 0 for record in records])
+                    ),
+                    "cached": float(np.mean([record.cache_hit for record in records])),
+                }
+            )
+        return rows
+
+
+class JsonlSink:
+    """Appends every call record as a line of JSON to a file, e.g. for offline analysis with pandas."""
+
+    def __init__(self, path: Path):
+        """
+        :param path: The JSONL file.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def emit(self, record: CallRecord) -> None:
+        line = json.dumps(record.to_dict()) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+class OpenTelemetrySink:
+    """Exports every call record as an OpenTelemetry span, so it shows up in the tracing backend."""
+
+    def __init__(self, tracer=None):
+        """
+        :param tracer: The OpenTelemetry tracer, the global tracer provider is used if not given.
+        """
+        if tracer is None:
+            from opentelemetry import trace
+
+            tracer = trace.get_tracer("llm_in_production")
+        self.tracer = tracer
+
+    def emit(self, record: CallRecord) -> None:
+        start_ns = int(record.start_time * 1e9)
+        span = self.tracer.start_span(f"llm {record.call_site}", start_time=start_ns)
+        for key, value in record.to_dict().items():
+            if value is not None:
+                span.set_attribute(f"llm.{key}", value)
+        span.end(end_time=start_ns + int(record.wall_time * 1e9))
+
+
+# The call that is in progress in the current thread or asyncio task,
+# so the HTTP layer can attribute queueing, retries and cache hits to it.
+_current_call: contextvars.ContextVar[CallRecord | None] = contextvars.ContextVar(
+    "current_llm_call", default=None
+)
+
+
+def get_current_call() -> CallRecord | None:
+    """Get the record of the LLM call that is in progress, if any."""
+    return _current_call.get()
+
+
+class InstrumentationCallbackHandler(BaseCallbackHandler):
+    """
+    A LangChain callback that measures every call of a chat model and sends a `CallRecord` to the sinks.
+
+    The call site is the function that called the model, e.g. `tool_calling_agent` or `extract_features`,
+    unless it is passed explicitly with `config={"metadata": {"call_site": ...}}`.
+    """
+
+    # Run in the caller's thread or task, so the HTTP requests of the call see its record.
+    run_inline = True
+
+    def __init__(self, sinks: list[CallRecordSink]):
+        """
+        :param sinks: The sinks that receive the records.
+        """
+        self.sinks = sinks
+        self._calls: dict[UUID, tuple[CallRecord, float]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list,
+        *,
+        run_id: UUID,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        metadata = metadata or {}
+        record = CallRecord(
+            call_site=metadata.get("call_site") or find_call_site(),
+            model=metadata.get("ls_model_name"),
+            start_time=time.time(),
+        )
+        with self._lock:
+            self._calls[run_id] = (record, time.perf_counter())
+        _current_call.set(record)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        record = self._finish(run_id)
+        if record is None:
+            return
+        usage = _get_usage(response)
+        if usage:
+            record.prompt_tokens = usage.get("input_tokens")
+            record.completion_tokens = usage.get("output_tokens")
+        self._emit(record)
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        record = self._finish(run_id)
+        if record is not None:
+            record.error = type(error).__name__
+            self._emit(record)
+
+    def _finish(self, run_id: UUID) -> CallRecord | None:
+        _current_call.set(None)
+        with self._lock:
+            record, start = self._calls.pop(run_id, (None, 0.0))
+        if record is not None:
+            record.wall_time = time.perf_counter() - start
+        return record
+
+    def _emit(self, record: CallRecord) -> None:
+        for sink in self.sinks:
+            sink.emit(record)
+
+
+def _get_usage(response: LLMResult) -> dict[str, int] | None:
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is not None and getattr(message, "usage_metadata", None):
+                return message.usage_metadata
+    token_usage = (response.llm_output or {}).get("token_usage")
+    if token_usage:
+        return {
+            "input_tokens": token_usage.get("prompt_tokens"),
+            "output_tokens": token_usage.get("completion_tokens"),
+        }
+    return None
+
+
+def find_call_site() -> str:
+    """
+    Find the code that calls the LLM, i.e. the first frame on the stack outside of LangChain and our LLM wrappers.
+    :return: The name of the function, or the name of the script for code at the top level.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not module.startswith(_INTERNAL_MODULES):
+            if frame.f_code.co_name == "<module>":
+                return Path(frame.f_code.co_filename).stem
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "unknown"
+
+
+def on_request(request: httpx.Request) -> None:
+    """Count an HTTP request, including retries, towards the LLM call in progress."""
+    record = _current_call.get()
+    if record is not None:
+        record.n_requests += 1
+
+
+def on_response(response: httpx.Response) -> None:
+    """Mark the LLM call in progress as a cache hit if its response came from the response cache."""
+    record = _current_call.get()
+    if record is not None and CACHE_HIT_HEADER in response.headers:
+        record.cache_hit = True
+
+
+def add_queue_time(seconds: float) -> None:
+    """Add time that was spent waiting before the request was sent, e.g. for the rate limiter."""
+    record = _current_call.get()
+    if record is not None:
+        record.queue_time += seconds
+
+
+# The records of the most recent calls of this process, and the callback that is attached to every client.
+call_records = RingBufferSink()
+instrumentation_callback = InstrumentationCallbackHandler([call_records])
+
+
+def add_sink(sink: CallRecordSink) -> None:
+    """
+    Send the records of all LLM calls to another sink as well, e.g. `add_sink(OpenTelemetrySink())`.
+    :param sink: The sink.
+    """
+    if sink not in instrumentation_callback.sinks:
+        instrumentation_callback.sinks.append(sink)
+
+
+def get_instrumentation_callback() -> InstrumentationCallbackHandler:
+    """
+    Get the callback that measures every LLM call of this process.
+    If `LLM_CALL_LOG_PATH` is set, the records are also appended to that JSONL file.
+    :return: The callback.
+    """
+    log_path = os.getenv("LLM_CALL_LOG_PATH")
+    if log_path:
+        add_sink(_get_jsonl_sink(log_path))
+    return instrumentation_callback
+
+
+@cache
+def _get_jsonl_sink(path: str) -> JsonlSink:
+    return JsonlSink(Path(path))
+
+
+def show_call_stats_in_sidebar() -> None:
+    """Show the p50 and p95 latency of the LLM calls per call site in the Streamlit sidebar."""
+    import pandas as pd
+
+    import streamlit as st
+
+    with st.sidebar:
+        st.header("LLM calls")
+        summary = call_records.summary()
+        if not summary:
+            st.caption("No calls yet.")
+            return
+        summary = pd.DataFrame(summary).set_index("call_site")
+        summary[["retried", "cached"]] *= 100
+        st.dataframe(
+            summary,
+            column_config={
+                "p50_s": st.column_config.NumberColumn("p50 (s)", format="%.2f"),
+                "p95_s": st.column_config.NumberColumn("p95 (s)", format="%.2f"),
+                "p95_queue_s": st.column_config.NumberColumn(
+                    "p95 queue (s)", format="%.2f"
+                ),
+                "completion_tokens": st.column_config.NumberColumn(
+                    "Tokens", format="%.0f"
+                ),
+                "retried": st.column_config.NumberColumn("Retried", format="%.0f%%"),
+                "cached": st.column_config.NumberColumn("Cached", format="%.0f%%"),
+            },
+        )
@@ -1,25 +1,369 @@
+import asyncio
 import os
-from typing import Literal
+import random
+import threading
+from functools import cache
+from typing import Literal, NamedTuple
 
+import httpx
 from dotenv import load_dotenv
+from langchain_core.language_models.base import LanguageModelInput
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+
+from llm_in_production import instrumentation
+from llm_in_production.hedging import HedgedChatModel
+from llm_in_production.rate_limiter import (
+    AsyncRateLimitedTransport,
+    RateLimitedTransport,
+    TokenBucketRateLimiter,
+    get_shared_rate_limiter,
+)
+from llm_in_production.response_cache import (
+    AsyncCachingTransport,
+    CachingTransport,
+    ResponseCache,
+    get_shared_response_cache,
+)
+
+LLMProvider = Literal["gcp", "azure", "aws", "openai"]
+
+# The connection pool that is shared by all requests of a client.
+# Keep-alive connections are reused for a minute, so a chat does not pay for a new TLS handshake per message.
+HTTP_LIMITS = httpx.Limits(
+    max_connections=100, max_keepalive_connections=20, keepalive_expiry=60
+)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# The httpcore trace events that are only emitted when a new connection is opened.
+_NEW_CONNECTION_EVENTS = {
+    "connection.connect_tcp.started",
+    "connection.connect_unix_socket.started",
+}
+
+
+class ClientCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    currsize: int
+    requests: int
+    new_connections: int
+
+    @property
+    def reused_connections(self) -> int:
+        return self.requests - self.new_connections
+
+
+class ClientCache:
+    """
+    A process-wide cache of LangChain chat models.
+
+    Streamlit runs a page from the top on every interaction, so a client that is created at module level
+    is rebuilt on every rerun, which throws away its open connections. This cache returns the same client
+    for the same provider and model settings. The clients share a tuned httpx connection pool,
+    and every request is traced to count how often a kept-alive connection was reused.
+    """
+
+    def __init__(self):
+        self._clients: dict[tuple, BaseChatModel] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self.new_connections = 0
+
+    def get_or_create(self, key: tuple, create) -> BaseChatModel:
+        """
+        Get the client for the key, creating it only once even if several threads ask for it at the same time.
+        :param key: The provider and model settings of the client.
+        :param create: The function that creates the client on a cache miss.
+        :return: The client.
+        """
+        with self._lock:
+            if key in self._clients:
+                self.hits += 1
+                return self._clients[key]
+            self.misses += 1
+            client = create()
+            self._clients[key] = client
+            return client
+
+    def create_http_client(
+        self,
+        rate_limiter: TokenBucketRateLimiter | None = None,
+        response_cache: ResponseCache | None = None,
+    ) -> httpx.Client:
+        """
+        Create a pooled httpx client of which the connection reuse is recorded.
+        :param rate_limiter: If given, every request waits for the rate limiter before it is sent.
+        :param response_cache: If given, deterministic requests are answered from this cache.
+        :return: The httpx client.
+        """
+        transport = httpx.HTTPTransport(limits=HTTP_LIMITS)
+        if rate_limiter is not None:
+            transport = RateLimitedTransport(transport, rate_limiter)
+        # Cache hits are answered before the rate limiter, so they do not use up the quota.
+        if response_cache is not None:
+            transport = CachingTransport(transport, response_cache)
+        return httpx.Client(
+            transport=transport,
+            timeout=HTTP_TIMEOUT,
+            event_hooks={
+                "request": [self._on_request, instrumentation.on_request],
+                "response": [instrumentation.on_response],
+            },
+        )
+
+    def create_http_async_client(
+        self,
+        rate_limiter: TokenBucketRateLimiter | None = None,
+        response_cache: ResponseCache | None = None,
+    ) -> httpx.AsyncClient:
+        """
+        Create a pooled async httpx client of which the connection reuse is recorded.
+        :param rate_limiter: If given, every request waits for the rate limiter before it is sent.
+        :param response_cache: If given, deterministic requests are answered from this cache.
+        :return: The async httpx client.
+        """
+        transport = httpx.AsyncHTTPTransport(limits=HTTP_LIMITS)
+        if rate_limiter is not None:
+            transport = AsyncRateLimitedTransport(transport, rate_limiter)
+        if response_cache is not None:
+            transport = AsyncCachingTransport(transport, response_cache)
+        return httpx.AsyncClient(
+            transport=transport,
+            timeout=HTTP_TIMEOUT,
+            event_hooks={
+                "request": [self._on_async_request, _on_async_instrumented_request],
+                "response": [_on_async_instrumented_response],
+            },
+        )
+
+    def cache_info(self) -> ClientCacheInfo:
+        """Report the client cache hits and misses and the connection reuse."""
+        with self._lock:
+            return ClientCacheInfo(
+                self.hits,
+                self.misses,
+                len(self._clients),
+                self.requests,
+                self.new_connections,
+            )
+
+    def cache_clear(self) -> None:
+        """Remove all clients and reset the statistics."""
+        with self._lock:
+            self._clients.clear()
+            self.hits = 0
+            self.misses = 0
+            self.requests = 0
+            self.new_connections = 0
+
+    def _on_request(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._trace
+        with self._lock:
+            self.requests += 1
+
+    async def _on_async_request(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._async_trace
+        with self._lock:
+            self.requests += 1
+
+    def _trace(self, event_name: str, info: dict) -> None:
+        if event_name in _NEW_CONNECTION_EVENTS:
+            with self._lock:
+                self.new_connections += 1
+
+    async def _async_trace(self, event_name: str, info: dict) -> None:
+        self._trace(event_name, info)
+
+
+async def _on_async_instrumented_request(request: httpx.Request) -> None:
+    instrumentation.on_request(request)
+
+
+async def _on_async_instrumented_response(response: httpx.Response) -> None:
+    instrumentation.on_response(response)
+
+
+# The cache that is shared by all pages of an app.
+client_cache = ClientCache()
+
+
+@cache
+def _load_dotenv_once() -> None:
+    load_dotenv()
 
 
 def instantiate_langchain_model(
-    llm_provider: Literal["gcp", "azure", "aws", "openai"] | None = None
+    llm_provider: LLMProvider | None = None, use_cache: bool = True
 ) -> BaseChatModel:
+    """
+    Get the chat model of an LLM provider.
+    The model is configured with the environment variables, e.g. from the `.env` file.
+    If `LLM_REQUESTS_PER_MINUTE` or `LLM_TOKENS_PER_MINUTE` is set, all clients share one rate limiter.
+    If `LLM_RESPONSE_CACHE_PATH` is set, calls with temperature 0 are answered from a shared response cache.
+    :param llm_provider: The LLM provider, read from the `LLM_PROVIDER` environment variable if not given.
+    :param use_cache: Whether to return the shared client for these settings instead of creating a new one.
+    :return: The chat model.
+    """
+    _load_dotenv_once()
     if llm_provider is None:
-        load_dotenv()
         llm_provider = os.environ["LLM_PROVIDER"]
+    rate_limiter = get_shared_rate_limiter()
+    response_cache = get_shared_response_cache()
+
+    def create() -> BaseChatModel:
+        return _create_langchain_model(
+            llm_provider,
+            http_client=client_cache.create_http_client(rate_limiter, response_cache),
+            http_async_client=client_cache.create_http_async_client(
+                rate_limiter, response_cache
+            ),
+            rate_limiter=rate_limiter,
+        )
+
+    if not use_cache:
+        return create()
+    return client_cache.get_or_create(
+        (*_get_model_settings(llm_provider), rate_limiter, response_cache), create
+    )
+
+
+def instantiate_hedged_langchain_model(
+    llm_providers: list[LLMProvider], hedge_delay: float = 2.0
+) -> HedgedChatModel:
+    """
+    Get a chat model that fails over between LLM providers and hedges slow calls,
+    e.g. `instantiate_hedged_langchain_model(["azure", "openai"])` when both serve the same model.
+    :param llm_providers: The LLM providers, each configured with its environment variables.
+    :param hedge_delay: The seconds to wait for the fastest provider before the next one is also called,
+        e.g. the p95 latency of the fastest provider.
+    :return: The chat model.
+    """
+    return HedgedChatModel(
+        backends=[instantiate_langchain_model(provider) for provider in llm_providers],
+        hedge_delay=hedge_delay,
+    )
+
+
+async def instantiate_async_langchain_model(
+    llm_provider: LLMProvider | None = None, use_cache: bool = True
+) -> BaseChatModel:
+    """
+    Get the chat model of an LLM provider from async code, e.g. to call `ainvoke` or `batch_invoke`.
+    Creating a client can block on reading the `.env` file or on authentication,
+    so it is done in a thread to keep the event loop responsive.
+    :param llm_provider: The LLM provider, read from the `LLM_PROVIDER` environment variable if not given.
+    :param use_cache: Whether to return the shared client for these settings instead of creating a new one.
+    :return: The chat model, which shares its async connection pool with all other users of the client.
+    """
+    return await asyncio.to_thread(
+        instantiate_langchain_model, llm_provider, use_cache=use_cache
+    )
+
+
+async def batch_invoke(
+    client: BaseChatModel,
+    prompts: list[LanguageModelInput],
+    max_concurrency: int = 8,
+    max_retries: int = 5,
+    initial_delay: float = 1.0,
+    max_delay: float = 30.0,
+    **kwargs,
+) -> list[BaseMessage]:
+    """
+    Invoke a chat model for many prompts concurrently, e.g. to extract the features of every row of a dataframe.
+    :param client: The chat model.
+    :param prompts: The prompts, each is anything that `client.invoke` accepts, such as a list of messages.
+    :param max_concurrency: The max number of requests that are in flight at the same time.
+    :param max_retries: The max number of times a prompt is retried after a rate limit error.
+    :param initial_delay: The delay in seconds before the first retry, it doubles with every retry.
+    :param max_delay: The max delay in seconds between two retries.
+    :param kwargs: Passed to `client.ainvoke`, e.g. `temperature` or `max_tokens`.
+    :return: The responses, in the same order as the prompts.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # The prompts run in their own tasks, where the caller is no longer on the stack,
+    # so the call site of the instrumentation is found once and passed to every call.
+    config = kwargs.pop("config", None) or {}
+    config = {
+        **config,
+        "metadata": {
+            "call_site": instrumentation.find_call_site(),
+            **config.get("metadata", {}),
+        },
+    }
+
+    async def invoke(prompt: LanguageModelInput) -> BaseMessage:
+        for attempt in range(max_retries + 1):
+            async with semaphore:
+                try:
+                    return await client.ainvoke(prompt, config, **kwargs)
+                except Exception as error:
+                    if not is_rate_limit_error(error) or attempt == max_retries:
+                        raise
+            # Back off outside the semaphore so the other prompts can use the slot,
+            # with jitter so the retries of the prompts do not hit the API at the same time.
+            delay = min(initial_delay * 2**attempt, max_delay)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
 
+    return list(await asyncio.gather(*(invoke(prompt) for prompt in prompts)))
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Check if an error means that the LLM provider is rate limiting us.
+    :param error: The error that was raised by the client.
+    :return: True for OpenAI's `RateLimitError`, Google's `ResourceExhausted` and any other HTTP 429 error.
+    """
+    if (
+        getattr(error, "status_code", None) == 429
+        or getattr(error, "code", None) == 429
+    ):
+        return True
+    return type(error).__name__ in {"RateLimitError", "ResourceExhausted"}
+
+
+def _get_model_settings(llm_provider: str) -> tuple:
+    # The settings that identify a client, without any secrets.
+    match llm_provider:
+        case "gcp":
+            return (
+                llm_provider,
+                os.getenv("GCP_PROJECT_ID"),
+                os.getenv("GCP_LOCATION"),
+            )
+        case "azure":
+            return (
+                llm_provider,
+                os.getenv("AZURE_OPENAI_ENDPOINT", os.getenv("OPENAI_API_BASE")),
+                os.getenv("GPT_4_MODEL_NAME"),
+            )
+        case _:
+            return llm_provider, os.getenv("GPT_4_MODEL_NAME")
+
+
+def _create_langchain_model(
+    llm_provider: str,
+    http_client: httpx.Client | None = None,
+    http_async_client: httpx.AsyncClient | None = None,
+    rate_limiter: TokenBucketRateLimiter | None = None,
+) -> BaseChatModel:
+    # Every call is measured, see `llm_in_production.instrumentation`.
+    callbacks = [instrumentation.get_instrumentation_callback()]
     match llm_provider:
         case "gcp":
+            # Vertex AI talks to Google over its own transport, so the httpx pool is not used.
+            # LangChain only limits its requests per minute, as it does not pass the number of tokens.
             from langchain_google_vertexai.chat_models import ChatVertexAI
 
             return ChatVertexAI(
                 model="gemini-1.5-flash",
                 project=os.getenv("GCP_PROJECT_ID"),
                 location=os.getenv("GCP_LOCATION"),
+                rate_limiter=rate_limiter,
+                callbacks=callbacks,
             )
 
         case "azure":
@@ -38,6 +382,9 @@ def instantiate_langchain_model(
                 api_version="2025-01-01-preview",
                 azure_deployment=os.environ["GPT_4_MODEL_NAME"],
                 model_name=os.environ["GPT_4_MODEL_NAME"],
+                http_client=http_client,
+                http_async_client=http_async_client,
+                callbacks=callbacks,
             )
 
         case "openai":
@@ -46,6 +393,9 @@ def instantiate_langchain_model(
             return ChatOpenAI(
                 api_key=os.environ["OPENAI_API_KEY"],
                 model_name=os.environ["GPT_4_MODEL_NAME"],
+                http_client=http_client,
+                http_async_client=http_async_client,
+                callbacks=callbacks,
             )
 
         case _:
@@ -12,3 +12,100 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     assert a.shape == b.shape, "a and b must have the same shape"
 
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+def normalize_rows(x: np.ndarray, eps: float = 1e-12) -> np.ndarray:
+    """
+    Scale every row to unit length, such that a dot product becomes a cosine similarity.
+    :param x: The vectors of shape (n_samples, n_features) or a single vector of shape (n_features,).
+    :param eps: A small value to avoid division by zero for all-zero rows.
+    :return: The normalized float32 vectors with the same shape as `x`.
+    """
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, eps)
+
+
+def cosine_similarity_matrix(
+    a: np.ndarray, b: np.ndarray | None = None, chunk_size: int = 4096
+) -> np.ndarray:
+    """
+    Compute the cosine similarity between every row of `a` and every row of `b`.
+    The rows are normalized once, after which the similarities are a single float32 matmul per chunk.
+    :param a: The first matrix of shape (n_a, n_features).
+    :param b: The second matrix of shape (n_b, n_features). If None, `a` is compared with itself.
+    :param chunk_size: The number of rows of `a` that are processed at once.
+    :return: The similarity matrix of shape (n_a, n_b).
+    """
+    assert len(a.shape) == 2, "a must be a matrix"
+    a_normalized = normalize_rows(a)
+    if b is None:
+        b_normalized = a_normalized
+    else:
+        assert len(b.shape) == 2, "b must be a matrix"
+        assert a.shape[1] == b.shape[1], "a and b must have the same number of features"
+        b_normalized = normalize_rows(b)
+
+    similarities = np.empty((len(a_normalized), len(b_normalized)), dtype=np.float32)
+    for start in range(0, len(a_normalized), chunk_size):
+        end = start + chunk_size
+        np.matmul(a_normalized[start:end], b_normalized.T, out=similarities[start:end])
+    return similarities
+
+
+def top_k_cosine_similarity(
+    queries: np.ndarray,
+    corpus: np.ndarray,
+    k: int,
+    chunk_size: int = 65536,
+    corpus_is_normalized: bool = False,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the k most similar corpus vectors for every query.
+    The corpus is scored in chunks, so the full (n_queries, n_corpus) matrix is never materialized.
+    :param queries: The queries of shape (n_queries, n_features) or a single query of shape (n_features,).
+    :param corpus: The corpus of shape (n_corpus, n_features).
+    :param k: The number of results per query.
+    :param chunk_size: The number of corpus rows that are scored at once.
+    :param corpus_is_normalized: Whether the corpus rows already have unit length, which skips normalizing them.
+    :return: The indices and similarities of the top k corpus vectors, sorted from most to least similar.
+        Their shape is (n_queries, k), or (k,) for a single query.
+    """
+    is_single_query = len(queries.shape) == 1
+    queries_normalized = normalize_rows(np.atleast_2d(queries))
+    assert (
+        queries_normalized.shape[1] == corpus.shape[1]
+    ), "queries and corpus must have the same number of features"
+    k = min(k, len(corpus))
+
+    best_indices = np.empty((len(queries_normalized), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries_normalized), 0), dtype=np.float32)
+    for start in range(0, len(corpus), chunk_size):
+        chunk = corpus[start : start + chunk_size]
+        if not corpus_is_normalized:
+            chunk = normalize_rows(chunk)
+        scores = queries_normalized @ chunk.T
+
+        # Keep the top k of this chunk, then the top k of the candidates seen so far.
+        indices = _top_k_unsorted(scores, k)
+        best_indices = np.concatenate([best_indices, indices + start], axis=1)
+        best_scores = np.concatenate(
+            [best_scores, np.take_along_axis(scores, indices, axis=1)], axis=1
+        )
+        keep = _top_k_unsorted(best_scores, k)
+        best_indices = np.take_along_axis(best_indices, keep, axis=1)
+        best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best_indices = np.take_along_axis(best_indices, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    if is_single_query:
+        return best_indices[0], best_scores[0]
+    return best_indices, best_scores
+
+
+def _top_k_unsorted(scores: np.ndarray, k: int) -> np.ndarray:
+    # argpartition finds the k largest values per row in linear time, without sorting them.
+    if scores.shape[1] <= k:
+        return np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
@@ -0,0 +1,328 @@
+import json
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from llm_in_production.numpy_utils import normalize_rows, top_k_cosine_similarity
+
+# A filter is either a dict that maps a metadata key to a value (or a list of allowed values),
+# or a function that receives the metadata of a document and returns whether to keep it.
+MetadataFilter = dict[str, Any] | Callable[[dict], bool]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    A lightweight in-memory vector store for small and medium corpora.
+
+    The vectors are kept in one contiguous, pre-normalized float32 matrix, so a search is a single matmul.
+    The metadata is stored column-wise and filters are applied before any vector is scored. Only equality
+    filters, e.g. `{"room": "Kuppelsaal"}`, are vectorized comparisons on a column; a list of allowed values
+    and a filter function are checked per document in Python.
+    It is not used by `build_db`, which builds a FAISS index; use it directly, e.g. in a notebook.
+    """
+
+    def __init__(self, embedding: Embeddings):
+        """
+        :param embedding: The embedding function that is used to embed the texts and the queries.
+        """
+        self.embedding = embedding
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._texts: list[str] = []
+        self._ids: list[str] = []
+        self._metadata_columns: dict[str, np.ndarray] = {}
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: list[dict] | None = None,
+        ids: list[str] | None = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        """
+        Embed the texts and create a vector store that contains them.
+        :param texts: The texts to store.
+        :param embedding: The embedding function.
+        :param metadatas: The metadata of every text.
+        :param ids: The id of every text. Random ids are generated if not given.
+        :return: The vector store.
+        """
+        store = cls(embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: list[dict] | None = None,
+        ids: list[str] | None = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        """
+        Embed the texts and add them to the vector store.
+        :param texts: The texts to add.
+        :param metadatas: The metadata of every text.
+        :param ids: The id of every text. Random ids are generated if not given.
+        :return: The ids of the added texts.
+        """
+        texts = list(texts)
+        vectors = np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+        return self.add_vectors(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def add_vectors(
+        self,
+        texts: list[str],
+        vectors: np.ndarray,
+        metadatas: list[dict] | None = None,
+        ids: list[str] | None = None,
+    ) -> list[str]:
+        """
+        Add texts of which the embeddings are already known.
+        :param texts: The texts to add.
+        :param vectors: The embeddings of shape (n_texts, n_features).
+        :param metadatas: The metadata of every text.
+        :param ids: The id of every text. Random ids are generated if not given.
+        :return: The ids of the added texts.
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        if not len(texts) == len(vectors) == len(metadatas) == len(ids):
+            raise ValueError(
+                "texts, vectors, metadatas and ids must have the same length"
+            )
+        if len(set(ids)) != len(ids) or not set(ids).isdisjoint(self._ids):
+            raise ValueError("Duplicate ids found in the ids list.")
+        if not texts:
+            return []
+
+        vectors = normalize_rows(vectors)
+        if len(self) == 0:
+            self._vectors = np.ascontiguousarray(vectors)
+        else:
+            self._vectors = np.concatenate([self._vectors, vectors])
+
+        n_existing = len(self)
+        for key in set(self._metadata_columns).union(*metadatas):
+            existing = self._metadata_columns.get(key, np.full(n_existing, None))
+            new = _to_object_array([metadata.get(key) for metadata in metadatas])
+            self._metadata_columns[key] = np.concatenate([existing, new])
+        self._texts.extend(texts)
+        self._ids.extend(ids)
+        return ids
+
+    def delete(self, ids: list[str] | None = None, **kwargs: Any) -> bool:
+        """
+        Delete the texts with the given ids.
+        :param ids: The ids to delete.
+        :return: True if the texts were deleted.
+        """
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        missing_ids = set(ids).difference(self._ids)
+        if missing_ids:
+            raise ValueError(
+                f"Some specified ids do not exist in the current store. Ids not found: {missing_ids}"
+            )
+
+        ids_to_delete = set(ids)
+        keep = np.array([id_ not in ids_to_delete for id_ in self._ids], dtype=bool)
+        self._vectors = np.ascontiguousarray(self._vectors[keep])
+        self._metadata_columns = {
+            key: column[keep] for key, column in self._metadata_columns.items()
+        }
+        self._texts = [text for text, kept in zip(self._texts, keep) if kept]
+        self._ids = [id_ for id_, kept in zip(self._ids, keep) if kept]
+        return True
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: MetadataFilter | None = None,
+        **kwargs: Any,
+    ) -> list[Document]:
+        """
+        Find the texts that are most similar to the query.
+        :param query: The query.
+        :param k: The number of results.
+        :param filter: Only consider the texts whose metadata match this filter.
+        :return: The most similar documents, most similar first.
+        """
+        return [
+            document
+            for document, _ in self.similarity_search_with_score(
+                query, k=k, filter=filter
+            )
+        ]
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: MetadataFilter | None = None,
+        **kwargs: Any,
+    ) -> list[tuple[Document, float]]:
+        """
+        Find the texts that are most similar to the query, together with their cosine similarity.
+        :param query: The query.
+        :param k: The number of results.
+        :param filter: Only consider the texts whose metadata match this filter.
+        :return: The most similar documents and their similarity, most similar first.
+        """
+        query_vector = np.asarray(self.embedding.embed_query(query), dtype=np.float32)
+        return self.similarity_search_with_score_by_vector(
+            query_vector, k=k, filter=filter
+        )
+
+    def similarity_search_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        filter: MetadataFilter | None = None,
+        **kwargs: Any,
+    ) -> list[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_with_score_by_vector(
+                embedding, k=k, filter=filter
+            )
+        ]
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: list[float] | np.ndarray,
+        k: int = 4,
+        filter: MetadataFilter | None = None,
+    ) -> list[tuple[Document, float]]:
+        """
+        Find the texts that are most similar to an embedding, together with their cosine similarity.
+        :param embedding: The query embedding.
+        :param k: The number of results.
+        :param filter: Only consider the texts whose metadata match this filter.
+        :return: The most similar documents and their similarity, most similar first.
+        """
+        if len(self) == 0 or k <= 0:
+            return []
+
+        candidates = self._filter(filter)
+        if len(candidates) == 0:
+            return []
+        vectors = self._vectors if filter is None else self._vectors[candidates]
+        indices, scores = top_k_cosine_similarity(
+            np.asarray(embedding, dtype=np.float32),
+            vectors,
+            k,
+            corpus_is_normalized=True,
+        )
+        return [
+            (self._get_document(candidates[i]), float(score))
+            for i, score in zip(indices, scores)
+        ]
+
+    def get_by_ids(self, ids: list[str]) -> list[Document]:
+        positions = {id_: i for i, id_ in enumerate(self._ids)}
+        return [self._get_document(positions[id_]) for id_ in ids if id_ in positions]
+
+    def save_local(self, folder_path: str) -> None:
+        """
+        Save the vector store to a folder.
+        :param folder_path: The folder to save to.
+        """
+        path = Path(folder_path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "vectors.npy", self._vectors)
+        with open(path / "documents.json", "w") as f:
+            json.dump(
+                {
+                    "ids": self._ids,
+                    "texts": self._texts,
+                    "metadata": {
+                        key: column.tolist()
+                        for key, column in self._metadata_columns.items()
+                    },
+                },
+                f,
+            )
+
+    @classmethod
+    def load_local(
+        cls, folder_path: str, embeddings: Embeddings, mmap: bool = True
+    ) -> "NumpyVectorStore":
+        """
+        Load a vector store that was saved with `save_local`.
+        :param folder_path: The folder the store was saved to.
+        :param embeddings: The embedding function that is used to embed queries.
+        :param mmap: Whether to memory-map the vectors instead of reading them into memory.
+        :return: The vector store.
+        """
+        path = Path(folder_path)
+        store = cls(embeddings)
+        store._vectors = np.load(path / "vectors.npy", mmap_mode="r" if mmap else None)
+        with open(path / "documents.json", "r") as f:
+            documents = json.load(f)
+        store._ids = documents["ids"]
+        store._texts = documents["texts"]
+        store._metadata_columns = {
+            key: _to_object_array(values)
+            for key, values in documents["metadata"].items()
+        }
+        return store
+
+    def _filter(self, filter: MetadataFilter | None) -> np.ndarray:
+        # Return the positions of the texts that match the filter.
+        if filter is None:
+            return np.arange(len(self))
+        if callable(filter):
+            mask = np.fromiter(
+                (filter(self._get_metadata(i)) for i in range(len(self))),
+                dtype=bool,
+                count=len(self),
+            )
+            return np.flatnonzero(mask)
+
+        mask = np.ones(len(self), dtype=bool)
+        for key, value in filter.items():
+            column = self._metadata_columns.get(key, np.full(len(self), None))
+            if isinstance(value, (list, tuple, set)):
+                allowed = set(value)
+                mask &= np.fromiter(
+                    (v in allowed for v in column), dtype=bool, count=len(self)
+                )
+            else:
+                mask &= column == value
+        return np.flatnonzero(mask)
+
+    def _get_metadata(self, position: int) -> dict:
+        return {
+            key: column[position]
+            for key, column in self._metadata_columns.items()
+            if column[position] is not None
+        }
+
+    def _get_document(self, position: int) -> Document:
+        return Document(
+            id=self._ids[position],
+            page_content=self._texts[position],
+            metadata=self._get_metadata(position),
+        )
+
+
+def _to_object_array(values: list) -> np.ndarray:
+    # np.array would turn a list of lists into a 2D array, so fill an object array explicitly.
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
@@ -1,25 +1,47 @@
-import copy
+from __future__ import annotations
+
+import json
 import os
 from functools import cache
+from typing import TYPE_CHECKING
 
 import dotenv
-from langchain_openai import AzureChatOpenAI
-from openai import AzureOpenAI, OpenAI
-from tiktoken import encoding_for_model
-from tokenizers.tokenizers import Encoding
+
+from llm_in_production.llm import client_cache
+from llm_in_production.rate_limiter import get_shared_rate_limiter
+from llm_in_production.response_cache import get_shared_response_cache
+from llm_in_production.token_utils import (
+    get_start_index_within_budget,
+    token_count_cache,
+)
+
+# The clients and the tokenizer are imported when they are used, so e.g. counting tokens
+# does not pay for importing LangChain's OpenAI integration.
+if TYPE_CHECKING:
+    from tiktoken import Encoding
 
 
 def get_openai_client(use_langchain=False, model_name=None, temperature=None):
-    """Load the openai client from the environment variables."""
+    """
+    Load the openai client from the environment variables.
+    If `LLM_REQUESTS_PER_MINUTE` or `LLM_TOKENS_PER_MINUTE` is set, the client shares a rate limiter
+    with all other LLM clients, so concurrent callers wait their turn instead of retrying 429s in lockstep.
+    If `LLM_RESPONSE_CACHE_PATH` is set, calls with temperature 0 are answered from a shared response cache.
+    """
 
     dotenv.load_dotenv()
 
     api_type = os.environ.get("OPENAI_API_TYPE", "openai")
+    rate_limiter = get_shared_rate_limiter()
+    response_cache = get_shared_response_cache()
 
     if api_type == "openai":
+        from openai import OpenAI
+
         return OpenAI(
             api_key=os.getenv("OPENAI_API_KEY"),
             max_retries=os.getenv("OPENAI_MAX_RETRIES", 5),
+            http_client=client_cache.create_http_client(rate_limiter, response_cache),
         )
 
     if api_type == "azure":
@@ -33,19 +55,32 @@ def get_openai_client(use_langchain=False, model_name=None, temperature=None):
                 os.environ["AZURE_OPENAI_API_KEY"] = os.environ["OPENAI_API_KEY"]
                 del os.environ["OPENAI_API_KEY"]
 
+            from langchain_openai import AzureChatOpenAI
+
             return AzureChatOpenAI(
                 api_version="2024-02-15-preview",
                 azure_deployment=model_name,
                 model_name=model_name,
                 temperature=temperature,
+                http_client=client_cache.create_http_client(
+                    rate_limiter, response_cache
+                ),
+                http_async_client=client_cache.create_http_async_client(
+                    rate_limiter, response_cache
+                ),
             )
 
         else:
+            from openai import AzureOpenAI
+
             return AzureOpenAI(
                 api_key=os.getenv("OPENAI_API_KEY"),
                 api_version="2024-12-01-preview",
                 azure_endpoint=os.getenv("OPENAI_API_BASE"),
                 max_retries=os.getenv("OPENAI_MAX_RETRIES", 5),
+                http_client=client_cache.create_http_client(
+                    rate_limiter, response_cache
+                ),
             )
 
     raise ValueError(f"Unknown api type {api_type}")
@@ -58,20 +93,88 @@ def get_number_of_tokens(text: str, model: str = "gpt-35-turbo") -> int:
 
 @cache
 def _get_encoding_for_model(model: str) -> Encoding:
+    from tiktoken import encoding_for_model
+
     return encoding_for_model(model)
 
 
-def pop_message_untill_less_tokens_then(messages: list[dict], tokens: int) -> dict:
-    """Ensure that the text fits into the token limit of the model"""
-    messages = copy.deepcopy(messages)
+# The chat format wraps every message in `<|start|>{role}\n{content}<|end|>\n`,
+# which costs a few tokens on top of the role and content themselves.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+# Every reply is primed with `<|start|>assistant<|message|>`.
+TOKENS_PER_REPLY = 3
+
+
+def get_n_tokens_per_message(
+    messages: list[dict], model: str = "gpt-35-turbo"
+) -> list[int]:
+    """
+    Count the tokens of every message, including the chat format overhead.
+    :param messages: The messages in the OpenAI chat format.
+    :param model: The model whose tokenizer is used.
+    :return: The number of tokens of each message, in the same order as `messages`.
+    """
+    return [
+        token_count_cache.get_num_tokens(
+            "openai_chat", model, message, lambda m: _count_tokens_in_message(m, model)
+        )
+        for message in messages
+    ]
+
+
+def _count_tokens_in_message(message: dict, model: str) -> int:
+    n_tokens = TOKENS_PER_MESSAGE
+    for key, value in message.items():
+        # e.g. the content of an assistant message with tool calls is None.
+        if value is None:
+            continue
+        # Structured values, such as `tool_calls` or content parts, are counted as the JSON they are sent as.
+        if not isinstance(value, str):
+            value = json.dumps(value, separators=(",", ":"), default=str)
+        n_tokens += get_number_of_tokens(value, model)
+        if key == "name":
+            n_tokens += TOKENS_PER_NAME
+    return n_tokens
+
+
+def trim_messages_to_token_limit(
+    messages: list[dict],
+    tokens: int,
+    model: str = "gpt-35-turbo",
+    n_tokens_per_message: list[int] | None = None,
+) -> list[dict]:
+    """
+    Drop the oldest messages until the conversation fits into the token limit.
+    A leading system message is always kept.
+    Token counts are cached per message; the cut-off is found with a prefix sum.
+    :param messages: The messages in the OpenAI chat format.
+    :param tokens: The maximum number of tokens the conversation may use, including the reply priming.
+    :param model: The model whose tokenizer is used.
+    :param n_tokens_per_message: Precomputed token counts of `messages`, if available.
+    :return: A new list that shares the message dicts with `messages` (no copies are made).
+    """
+    if n_tokens_per_message is None:
+        n_tokens_per_message = get_n_tokens_per_message(messages, model)
+
+    system_messages = []
+    if messages and messages[0]["role"] == "system":
+        system_messages = messages[:1]
+        budget = tokens - TOKENS_PER_REPLY - n_tokens_per_message[0]
+        messages = messages[1:]
+        n_tokens_per_message = n_tokens_per_message[1:]
+    else:
+        budget = tokens - TOKENS_PER_REPLY
+
+    start = get_start_index_within_budget(n_tokens_per_message, budget)
+    return system_messages + messages[start:]
 
-    while get_n_tokens_in_message(messages) > tokens:
-        messages.pop(0)
 
-    return messages
+def pop_message_untill_less_tokens_then(messages: list[dict], tokens: int) -> dict:
+    """Ensure that the text fits into the token limit of the model"""
+    return trim_messages_to_token_limit(messages, tokens)
 
 
 def get_n_tokens_in_message(messages: list[dict]):
     """Get the number of tokens in a message"""
-    all_text = " ".join(message["content"] for message in messages)
-    return get_number_of_tokens(all_text)
+    return sum(get_n_tokens_per_message(messages)) + TOKENS_PER_REPLY
@@ -1,6 +1,24 @@
-import copy
+import errno
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Literal
 
+import numpy as np
 from langchain.schema import BaseMessage
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from llm_in_production.token_utils import (
+    get_role_and_content,
+    get_start_index_within_budget,
+    token_count_cache,
+)
 
 
 def pop_messages_until_within_token_limit(
@@ -8,14 +26,38 @@ def pop_messages_until_within_token_limit(
 ) -> list[BaseMessage]:
     """
     Ensure that the messages fit within the token limit for the model by
-    progressively removing the earliest messages.
+    removing the earliest messages. A leading system message is always kept.
+    Token counts are cached per message, so only new messages are tokenized.
     """
-    messages = copy.deepcopy(messages)
+    n_tokens_per_message = get_n_tokens_per_message(messages, client)
 
-    while get_n_tokens_in_messages(messages, client) > token_limit:
-        messages.pop(0)
+    system_messages = []
+    budget = token_limit
+    if messages and get_role_and_content(messages[0])[0] == "system":
+        system_messages = messages[:1]
+        budget -= n_tokens_per_message[0]
+        messages = messages[1:]
+        n_tokens_per_message = n_tokens_per_message[1:]
 
-    return messages
+    start = get_start_index_within_budget(n_tokens_per_message, budget)
+    return system_messages + messages[start:]
+
+
+def get_n_tokens_per_message(messages: list[BaseMessage], client) -> list[int]:
+    """
+    Get the number of tokens of every message, using the shared token count cache.
+    This function supports LangChain message objects.
+    """
+    model = getattr(client, "model_name", None) or type(client).__name__
+    return [
+        token_count_cache.get_num_tokens(
+            "langchain",
+            model,
+            message,
+            lambda m: client.get_num_tokens(get_role_and_content(m)[1]),
+        )
+        for message in messages
+    ]
 
 
 def get_n_tokens_in_messages(messages: list[BaseMessage], client) -> int:
@@ -23,5 +65,275 @@ def get_n_tokens_in_messages(messages: list[BaseMessage], client) -> int:
     Get the total number of tokens in a list of messages.
     This function supports LangChain message objects.
     """
-    all_text = " ".join(message["content"] for message in messages)
-    return client.get_num_tokens(all_text)
+    return sum(get_n_tokens_per_message(messages, client))
+
+
+def get_index_cache_key(data_path: Path, **settings: Any) -> str:
+    """
+    Create a cache key for a vector index that changes whenever the data or the settings change.
+    :param data_path: The file with the data that is indexed.
+    :param settings: The settings that influence the index, such as the chunk size and the embedding model.
+    :return: A hex digest that can be used as directory name.
+    """
+    digest = hashlib.sha256()
+    digest.update(Path(data_path).read_bytes())
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
+
+
+def save_faiss_index(db, path: Path, bm25_index=None) -> None:
+    """
+    Save a FAISS vector store to disk.
+    The store is written to a temporary directory first, so a concurrent reader never sees a partial index.
+    :param db: The FAISS vector store.
+    :param path: The directory to save the store to.
+    :param bm25_index: A `BM25Index` over the same chunks, saved next to the store if given.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(tempfile.mkdtemp(dir=path.parent, prefix=f".{path.name}-"))
+    try:
+        db.save_local(str(tmp_path))
+        if bm25_index is not None:
+            bm25_index.save(tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        # Another process saved the same index in the meantime, any other error (e.g. a full disk) is real.
+        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+            raise
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def load_faiss_index(path: Path, embedding: Embeddings):
+    """
+    Load a FAISS vector store that was saved with `save_faiss_index`.
+    The index is read into memory, because FAISS cannot copy the lists of a memory-mapped IVF index,
+    which `build_or_update_faiss_index` does to update the store.
+    :param path: The directory the store was saved to.
+    :param embedding: The embedding function that is used to embed queries.
+    :return: The FAISS vector store.
+    """
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    path = Path(path)
+    index = faiss.read_index(str(path / "index.faiss"))
+    # The pickle is only ever written by `save_faiss_index` on this machine.
+    with open(path / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embedding, index, docstore, index_to_docstore_id)
+
+
+def get_chunk_ids(texts: list[str], metadatas: list[dict]) -> list[str]:
+    """
+    Create a content-based id for every chunk, such that the same chunk always gets the same id.
+    :param texts: The text of every chunk.
+    :param metadatas: The metadata of every chunk.
+    :return: The id of every chunk.
+    """
+    ids = []
+    for text, metadata in zip(texts, metadatas):
+        digest = hashlib.sha256(text.encode())
+        digest.update(json.dumps(metadata, sort_keys=True, default=str).encode())
+        ids.append(digest.hexdigest()[:32])
+    return ids
+
+
+@dataclass(frozen=True)
+class FaissIndexSpec:
+    """
+    Describes which FAISS index to build.
+    - "flat": exact search, every query is compared with every vector.
+    - "ivf_flat": the vectors are clustered into `n_lists` lists, a query only searches the `nprobe` closest lists.
+    - "hnsw": a graph index, `ef_search` controls how much of the graph is explored per query.
+    - "ivf_pq": like "ivf_flat", but the lists are searched with vectors that are compressed with product
+      quantization into `pq_m` codes. The compression loses too much for a good top k on its own, so the best
+      `refine_k_factor` * k candidates are re-ranked with the exact vectors, which are kept in memory as well.
+    The approximate indexes trade a bit of recall for much faster search on large corpora.
+    """
+
+    kind: Literal["flat", "ivf_flat", "hnsw", "ivf_pq"] = "flat"
+    n_lists: int = 256
+    hnsw_m: int = 32
+    pq_m: int = 16
+    pq_bits: int = 8
+    refine_k_factor: int = 32
+    training_sample_size: int = 25_000
+
+    def create_index(self, vectors: np.ndarray, seed: int = 42):
+        """
+        Create and train (if needed) an empty index for the given vectors.
+        The number of lists and the PQ bits are reduced when there are too few vectors to train them.
+        :param vectors: The vectors that will be added, a sample of them is used for training.
+        :param seed: The seed used to draw the training sample.
+        :return: The trained but empty FAISS index.
+        """
+        import faiss
+
+        n_vectors, dim = vectors.shape
+        training_vectors = vectors
+        if n_vectors > self.training_sample_size:
+            rng = np.random.default_rng(seed)
+            sample = rng.choice(n_vectors, self.training_sample_size, replace=False)
+            training_vectors = vectors[np.sort(sample)]
+        n_train = len(training_vectors)
+        # k-means needs at least one training vector per cluster.
+        n_lists = max(1, min(self.n_lists, n_train))
+        pq_bits = max(1, min(self.pq_bits, int(np.log2(max(n_train, 2)))))
+
+        match self.kind:
+            case "flat":
+                description = "Flat"
+            case "ivf_flat":
+                description = f"IVF{n_lists},Flat"
+            case "hnsw":
+                description = f"HNSW{self.hnsw_m}"
+            case "ivf_pq":
+                description = f"IVF{n_lists},PQ{self.pq_m}x{pq_bits},RFlat"
+            case _:
+                raise ValueError(f"Unknown index kind: {self.kind}")
+
+        index = faiss.index_factory(dim, description, faiss.METRIC_L2)
+        if not index.is_trained:
+            index.train(training_vectors)
+        if self.kind == "ivf_pq":
+            faiss.downcast_index(index).k_factor = self.refine_k_factor
+        return index
+
+    def matches(self, index) -> bool:
+        """Check whether an existing index was built with this kind of spec."""
+        import faiss
+
+        index = faiss.downcast_index(index)
+        if self.kind == "ivf_pq":
+            # An IVF-PQ index without the exact vectors to re-rank with is rebuilt.
+            return isinstance(index, faiss.IndexRefine) and isinstance(
+                faiss.downcast_index(index.base_index), faiss.IndexIVFPQ
+            )
+        index_types = {
+            "flat": faiss.IndexFlat,
+            "ivf_flat": faiss.IndexIVFFlat,
+            "hnsw": faiss.IndexHNSW,
+        }
+        return isinstance(index, index_types[self.kind])
+
+
+def set_faiss_search_params(
+    db, nprobe: int | None = None, ef_search: int | None = None
+) -> None:
+    """
+    Set the query-time parameters of an approximate FAISS index. Parameters that do not apply are ignored.
+    :param db: The FAISS vector store.
+    :param nprobe: The number of IVF lists to search, higher is more accurate but slower.
+    :param ef_search: The size of the HNSW candidate list, higher is more accurate but slower.
+    """
+    import faiss
+
+    index = faiss.downcast_index(db.index)
+    if isinstance(index, faiss.IndexRefine):
+        # The parameters apply to the index that finds the candidates, which are then re-ranked.
+        index = faiss.downcast_index(index.base_index)
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def build_or_update_faiss_index(
+    texts: list[str],
+    metadatas: list[dict],
+    embedding: Embeddings,
+    db=None,
+    index_spec: FaissIndexSpec | None = None,
+):
+    """
+    Build a FAISS vector store, or bring an existing one up to date with the given chunks.
+    When a store is given, only the chunks that are not in it yet are embedded,
+    the chunks that no longer exist are deleted and all other vectors are kept.
+    :param texts: The text of every chunk.
+    :param metadatas: The metadata of every chunk.
+    :param embedding: The embedding function.
+    :param db: The existing FAISS vector store, if any. It is not modified.
+    :param index_spec: The kind of FAISS index to build, an exact flat index by default.
+        An existing store with a different kind of index is rebuilt.
+    :return: The new FAISS vector store.
+    """
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    index_spec = index_spec or FaissIndexSpec()
+
+    # The same chunk can occur twice (e.g. two talks with the same abstract), but an id may only be stored once.
+    chunks = {}
+    for chunk_id, text, metadata in zip(
+        get_chunk_ids(texts, metadatas), texts, metadatas
+    ):
+        chunks.setdefault(chunk_id, (text, metadata))
+
+    if db is None or not index_spec.matches(db.index):
+        vectors = np.asarray(
+            embedding.embed_documents([text for text, _ in chunks.values()]),
+            dtype=np.float32,
+        )
+        index = index_spec.create_index(vectors)
+        index.add(vectors)
+        docstore = InMemoryDocstore(
+            {
+                chunk_id: Document(id=chunk_id, page_content=text, metadata=metadata)
+                for chunk_id, (text, metadata) in chunks.items()
+            }
+        )
+        return FAISS(embedding, index, docstore, dict(enumerate(chunks.keys())))
+
+    # Work on a copy, such that the existing (possibly shared) store stays intact.
+    db = FAISS(
+        embedding,
+        faiss.clone_index(db.index),
+        InMemoryDocstore(dict(db.docstore._dict)),
+        dict(db.index_to_docstore_id),
+    )
+    existing_ids = set(db.index_to_docstore_id.values())
+
+    removed_ids = existing_ids - chunks.keys()
+    if removed_ids:
+        if index_spec.kind == "flat":
+            db.delete(list(removed_ids))
+        else:
+            # HNSW cannot remove vectors and IVF keeps the ids of the removed vectors,
+            # which LangChain does not expect, so refill the (already trained) index instead.
+            _refill_without(db, removed_ids)
+
+    new_ids = [chunk_id for chunk_id in chunks if chunk_id not in existing_ids]
+    if new_ids:
+        db.add_texts(
+            [chunks[chunk_id][0] for chunk_id in new_ids],
+            metadatas=[chunks[chunk_id][1] for chunk_id in new_ids],
+            ids=new_ids,
+        )
+    return db
+
+
+def _refill_without(db, removed_ids: set[str]) -> None:
+    import faiss
+
+    kept = [
+        (position, chunk_id)
+        for position, chunk_id in sorted(db.index_to_docstore_id.items())
+        if chunk_id not in removed_ids
+    ]
+    index = faiss.downcast_index(db.index)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    vectors = index.reconstruct_n(0, index.ntotal)[[p for p, _ in kept]]
+    if isinstance(index, faiss.IndexIVF):
+        index.set_direct_map_type(faiss.DirectMap.NoMap)
+
+    # Resetting keeps the trained clusters and codebooks, so no re-training is needed.
+    db.index.reset()
+    db.index.add(vectors)
+    db.docstore.delete(list(removed_ids))
+    db.index_to_docstore_id = {i: chunk_id for i, (_, chunk_id) in enumerate(kept)}
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from functools import cache
+
+import httpx
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from llm_in_production.instrumentation import add_queue_time
+
+# The number of completion tokens that is reserved when a request does not set `max_tokens`.
+DEFAULT_COMPLETION_TOKENS = 512
+
+
+class _Bucket:
+    """A token bucket that refills continuously and may go into debt for reservations."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+class TokenBucketRateLimiter(BaseRateLimiter):
+    """
+    A client-side rate limiter for both requests per minute (RPM) and tokens per minute (TPM).
+
+    Retrying after a 429 makes all waiting callers retry at the same moment, so they are rejected again.
+    This limiter instead hands out reservations: a call immediately takes its requests and tokens
+    from the buckets, which may go into debt, and then sleeps exactly until the buckets have refilled
+    that debt. Calls are therefore admitted just in time, in the order in which they arrived.
+    One instance can be shared by threads and asyncio tasks, as reserving only holds a lock briefly.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+    ):
+        """
+        :param requests_per_minute: The max number of requests per minute, unlimited if not given.
+        :param tokens_per_minute: The max number of prompt and completion tokens per minute, unlimited if not given.
+        """
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+        self.n_requests = 0
+        self.total_wait_time = 0.0
+
+    def acquire(self, *, blocking: bool = True, n_tokens: int = 0) -> bool:
+        """
+        Wait until a request of `n_tokens` tokens may be sent.
+        :param blocking: Whether to wait. If False, only admit the request if it may be sent right away.
+        :param n_tokens: The estimated number of prompt and completion tokens of the request.
+        :return: True if the request may be sent.
+        """
+        wait_time = self._reserve(n_tokens, blocking)
+        if wait_time is None:
+            return False
+        time.sleep(wait_time)
+        add_queue_time(wait_time)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True, n_tokens: int = 0) -> bool:
+        """
+        Wait until a request of `n_tokens` tokens may be sent, without blocking the event loop.
+        :param blocking: Whether to wait. If False, only admit the request if it may be sent right away.
+        :param n_tokens: The estimated number of prompt and completion tokens of the request.
+        :return: True if the request may be sent.
+        """
+        wait_time = self._reserve(n_tokens, blocking)
+        if wait_time is None:
+            return False
+        await asyncio.sleep(wait_time)
+        add_queue_time(wait_time)
+        return True
+
+    def _reserve(self, n_tokens: int, blocking: bool) -> float | None:
+        # Take the request and its tokens and return how long to wait, or None if we may not wait.
+        buckets = [(self._requests, 1), (self._tokens, n_tokens)]
+        buckets = [(bucket, amount) for bucket, amount in buckets if bucket]
+        with self._lock:
+            now = time.monotonic()
+            wait_time = max(
+                (bucket.wait_time(amount, now) for bucket, amount in buckets),
+                default=0.0,
+            )
+            if wait_time > 0 and not blocking:
+                return None
+            for bucket, amount in buckets:
+                bucket.take(amount)
+            self.n_requests += 1
+            self.total_wait_time += wait_time
+        return wait_time
+
+
+def get_shared_rate_limiter() -> TokenBucketRateLimiter | None:
+    """
+    Get the rate limiter that is shared by all LLM clients of this process.
+    It is configured with the `LLM_REQUESTS_PER_MINUTE` and `LLM_TOKENS_PER_MINUTE` environment variables,
+    which should match the quota of the deployment.
+    :return: The rate limiter, or None if no limits are configured.
+    """
+    requests_per_minute = os.getenv("LLM_REQUESTS_PER_MINUTE")
+    tokens_per_minute = os.getenv("LLM_TOKENS_PER_MINUTE")
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    return _get_rate_limiter(
+        float(requests_per_minute or 0), float(tokens_per_minute or 0)
+    )
+
+
+@cache
+def _get_rate_limiter(
+    requests_per_minute: float, tokens_per_minute: float
+) -> TokenBucketRateLimiter:
+    return TokenBucketRateLimiter(requests_per_minute, tokens_per_minute)
+
+
+def estimate_request_tokens(request: httpx.Request) -> int:
+    """
+    Estimate the number of tokens that a chat completion request counts against the TPM quota.
+    :param request: The HTTP request to the OpenAI or Azure OpenAI API.
+    :return: The number of prompt tokens plus the max number of completion tokens.
+    """
+    from llm_in_production.openai_utils import get_number_of_tokens
+
+    try:
+        body = json.loads(request.content)
+    except (ValueError, UnicodeDecodeError):
+        return 0
+    if not isinstance(body, dict):
+        return 0
+
+    texts = []
+    for message in body.get("messages", []):
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            # Multimodal content is a list of parts, only the text parts are counted.
+            content = " ".join(part.get("text", "") for part in content)
+        texts.append(content)
+    n_prompt_tokens = get_number_of_tokens("\n".join(texts)) if texts else 0
+    n_completion_tokens = (
+        body.get("max_completion_tokens")
+        or body.get("max_tokens")
+        or DEFAULT_COMPLETION_TOKENS
+    )
+    return n_prompt_tokens + n_completion_tokens
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """
+    An httpx transport that waits for the rate limiter before every request is sent.
+    Retries of the OpenAI client also pass through the transport, so they are rate limited as well.
+    """
+
+    def __init__(
+        self, transport: httpx.BaseTransport, rate_limiter: TokenBucketRateLimiter
+    ):
+        """
+        :param transport: The transport that sends the requests, e.g. a pooled `httpx.HTTPTransport`.
+        :param rate_limiter: The rate limiter.
+        """
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.rate_limiter.acquire(n_tokens=estimate_request_tokens(request))
+        return self.transport.handle_request(request)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """The async version of `RateLimitedTransport`."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        rate_limiter: TokenBucketRateLimiter,
+    ):
+        """
+        :param transport: The transport that sends the requests, e.g. a pooled `httpx.AsyncHTTPTransport`.
+        :param rate_limiter: The rate limiter.
+        """
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.rate_limiter.aacquire(n_tokens=estimate_request_tokens(request))
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
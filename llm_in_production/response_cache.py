@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import cache
+from pathlib import Path
+from typing import NamedTuple
+
+import httpx
+
+# The header that marks a response that was served from the cache.
+CACHE_HIT_HEADER = "x-response-cache"
+
+
+class ResponseCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    max_entries: int
+    currsize: int
+
+
+class ResponseCache:
+    """
+    An exact-match cache of LLM responses, stored in SQLite so it survives restarts and is shared by processes.
+
+    Entries expire after `ttl` seconds, and when the cache holds more than `max_entries` responses,
+    the least recently used ones are evicted.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: float | None = 7 * 24 * 3600,
+        max_entries: int = 10_000,
+    ):
+        """
+        :param path: The SQLite database file.
+        :param ttl: The number of seconds a response stays valid, or None to keep it until it is evicted.
+        :param max_entries: The max number of responses to keep.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        # Write-ahead logging lets other processes read while one of them writes.
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, content BLOB, content_type TEXT, created REAL, accessed REAL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> tuple[bytes, str] | None:
+        """
+        Look up a response.
+        :param key: The key of the request, see `get_request_key`.
+        :return: The content and the content type of the response, or None if it is not cached or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content, content_type, created FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and self.ttl is not None and row[2] < now - self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0], row[1]
+
+    def set(self, key: str, content: bytes, content_type: str) -> None:
+        """
+        Store a response and evict the least recently used responses if the cache is full.
+        :param key: The key of the request, see `get_request_key`.
+        :param content: The body of the response.
+        :param content_type: The content type of the response.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, content, content_type, now, now),
+            )
+            if self.ttl is not None:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+                )
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def cache_info(self) -> ResponseCacheInfo:
+        """Report the hit and miss counts, like `functools.lru_cache`."""
+        with self._lock:
+            (currsize,) = self._connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()
+            return ResponseCacheInfo(self.hits, self.misses, self.max_entries, currsize)
+
+    def cache_clear(self) -> None:
+        """Remove all responses and reset the statistics."""
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self.hits = 0
+            self.misses = 0
+
+
+def get_shared_response_cache() -> ResponseCache | None:
+    """
+    Get the response cache that is shared by all LLM clients of this process.
+    It is enabled by setting `LLM_RESPONSE_CACHE_PATH` to the path of the SQLite file.
+    `LLM_RESPONSE_CACHE_TTL` and `LLM_RESPONSE_CACHE_MAX_ENTRIES` tune the expiry and the size.
+    :return: The response cache, or None if it is not enabled.
+    """
+    path = os.getenv("LLM_RESPONSE_CACHE_PATH")
+    if not path:
+        return None
+    return _get_response_cache(
+        path,
+        float(os.getenv("LLM_RESPONSE_CACHE_TTL", 7 * 24 * 3600)),
+        int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", 10_000)),
+    )
+
+
+@cache
+def _get_response_cache(path: str, ttl: float, max_entries: int) -> ResponseCache:
+    return ResponseCache(Path(path), ttl=ttl, max_entries=max_entries)
+
+
+def is_deterministic(body: dict) -> bool:
+    """
+    Check if a chat completion request always gets the same answer, so its response may be reused.
+    :param body: The JSON body of the request.
+    :return: True if the temperature is 0 and a single, non-streamed completion is requested.
+    """
+    return (
+        body.get("temperature") == 0
+        and not body.get("stream", False)
+        and body.get("n", 1) == 1
+    )
+
+
+def get_request_key(request: httpx.Request) -> str | None:
+    """
+    Get the cache key of a request.
+    The key is a hash of the endpoint and the canonical JSON of the body, which holds the messages,
+    the model, the tools and the sampling parameters, so only identical requests share a key.
+    :param request: The HTTP request to the OpenAI or Azure OpenAI API.
+    :return: The key, or None if the request must not be cached.
+    """
+    if request.method != "POST":
+        return None
+    try:
+        body = json.loads(request.content)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(body, dict) or not is_deterministic(body):
+        return None
+
+    digest = hashlib.sha256()
+    digest.update(f"{request.url.host}{request.url.path}\x00".encode())
+    digest.update(json.dumps(body, sort_keys=True, separators=(",", ":")).encode())
+    return digest.hexdigest()
+
+
+def _get_cached_response(
+    cache: ResponseCache, key: str | None
+) -> httpx.Response | None:
+    cached = cache.get(key) if key is not None else None
+    if cached is None:
+        return None
+    content, content_type = cached
+    return httpx.Response(
+        200,
+        headers={"content-type": content_type, CACHE_HIT_HEADER: "hit"},
+        content=content,
+    )
+
+
+class CachingTransport(httpx.BaseTransport):
+    """An httpx transport that answers deterministic requests from a `ResponseCache`."""
+
+    def __init__(self, transport: httpx.BaseTransport, cache: ResponseCache):
+        """
+        :param transport: The transport that sends the requests that are not cached.
+        :param cache: The response cache.
+        """
+        self.transport = transport
+        self.cache = cache
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = get_request_key(request)
+        cached_response = _get_cached_response(self.cache, key)
+        if cached_response is not None:
+            return cached_response
+        response = self.transport.handle_request(request)
+        if key is not None and response.status_code == 200:
+            response.read()
+            self.cache.set(
+                key,
+                response.content,
+                response.headers.get("content-type", "application/json"),
+            )
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncCachingTransport(httpx.AsyncBaseTransport):
+    """The async version of `CachingTransport`."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, cache: ResponseCache):
+        """
+        :param transport: The transport that sends the requests that are not cached.
+        :param cache: The response cache.
+        """
+        self.transport = transport
+        self.cache = cache
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = get_request_key(request)
+        cached_response = _get_cached_response(self.cache, key)
+        if cached_response is not None:
+            return cached_response
+        response = await self.transport.handle_async_request(request)
+        if key is not None and response.status_code == 200:
+            await response.aread()
+            self.cache.set(
+                key,
+                response.content,
+                response.headers.get("content-type", "application/json"),
+            )
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
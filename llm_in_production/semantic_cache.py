@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+from llm_in_production.numpy_utils import normalize_rows, top_k_cosine_similarity
+
+
+class SemanticCacheHit(NamedTuple):
+    query: str
+    answer: str
+    similarity: float
+
+
+class _Scope:
+    """The cached queries of one scope, in a ring buffer that overwrites the oldest query when it is full."""
+
+    def __init__(self, n_features: int, max_entries: int):
+        self.vectors = np.zeros((max_entries, n_features), dtype=np.float32)
+        self.queries: list[str] = []
+        self.answers: list[str] = []
+        self.next_row = 0
+
+    def add(self, vector: np.ndarray, query: str, answer: str) -> None:
+        row = self.next_row
+        self.vectors[row] = vector
+        if row < len(self.answers):
+            self.queries[row] = query
+            self.answers[row] = answer
+        else:
+            self.queries.append(query)
+            self.answers.append(answer)
+        self.next_row = (row + 1) % len(self.vectors)
+
+
+class SemanticCache:
+    """
+    A cache of answers that is looked up by the meaning of a query instead of its exact text.
+
+    Users ask the same question in different words, e.g. "when is the keynote" and "keynote time?".
+    The query embeddings of past answers are kept in a normalized matrix, so a lookup is a single
+    matrix-vector product; the best match is used if its cosine similarity is above a threshold.
+    Entries are grouped by a scope, e.g. the version of the index that the answers were based on,
+    so answers from before a re-index are never returned.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_scopes: int = 4):
+        """
+        :param max_entries: The max number of answers per scope, the oldest answer is replaced first.
+        :param max_scopes: The max number of scopes, the least recently used scope is dropped first.
+        """
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        self._scopes: OrderedDict[str, _Scope] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(
+        self, query_vector: list[float] | np.ndarray, scope: str, threshold: float
+    ) -> SemanticCacheHit | None:
+        """
+        Find the answer of the most similar past query.
+        :param query_vector: The embedding of the query.
+        :param scope: The scope to search in, e.g. the index version.
+        :param threshold: The min cosine similarity between the queries.
+        :return: The past query, its answer and the similarity, or None if no past query is similar enough.
+        """
+        query_vector = normalize_rows(np.asarray(query_vector, dtype=np.float32))
+        with self._lock:
+            cached = self._scopes.get(scope)
+            if cached is not None and cached.answers:
+                self._scopes.move_to_end(scope)
+                indices, scores = top_k_cosine_similarity(
+                    query_vector,
+                    cached.vectors[: len(cached.answers)],
+                    k=1,
+                    corpus_is_normalized=True,
+                )
+                if scores[0] >= threshold:
+                    self.hits += 1
+                    i = indices[0]
+                    return SemanticCacheHit(
+                        cached.queries[i], cached.answers[i], float(scores[0])
+                    )
+            self.misses += 1
+            return None
+
+    def add(
+        self,
+        query_vector: list[float] | np.ndarray,
+        query: str,
+        answer: str,
+        scope: str,
+    ) -> None:
+        """
+        Remember the answer to a query.
+        :param query_vector: The embedding of the query.
+        :param query: The query.
+        :param answer: The answer.
+        :param scope: The scope of the answer, e.g. the index version.
+        """
+        query_vector = normalize_rows(np.asarray(query_vector, dtype=np.float32))
+        with self._lock:
+            if scope not in self._scopes:
+                self._scopes[scope] = _Scope(len(query_vector), self.max_entries)
+                while len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+            self._scopes.move_to_end(scope)
+            self._scopes[scope].add(query_vector, query, answer)
+
+    def invalidate(self, scope: str) -> None:
+        """
+        Remove all answers of a scope.
+        :param scope: The scope, e.g. the version of an index that was rebuilt.
+        """
+        with self._lock:
+            self._scopes.pop(scope, None)
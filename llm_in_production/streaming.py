@@ -0,0 +1,84 @@
+import time
+from typing import Callable, NamedTuple
+
+from langchain_core.language_models.base import LanguageModelInput
+from langchain_core.language_models.chat_models import BaseChatModel
+
+
+class StreamedResponse(NamedTuple):
+    content: str
+    time_to_first_token: float
+    total_time: float
+    n_tokens: int
+
+    @property
+    def tokens_per_second(self) -> float:
+        # The generation speed after the first token, which excludes the queueing and the prompt processing.
+        generation_time = self.total_time - self.time_to_first_token
+        return (self.n_tokens - 1) / generation_time if generation_time > 0 else 0.0
+
+
+def stream_response(
+    client: BaseChatModel,
+    input: LanguageModelInput,
+    on_update: Callable[[str], None] | None = None,
+    update_interval: float = 0.05,
+    **kwargs,
+) -> StreamedResponse:
+    """
+    Stream a response of a chat model, so the user can start reading as soon as the first token arrives.
+    This works for every provider of `instantiate_langchain_model`, as it only uses `client.stream`.
+    :param client: The chat model.
+    :param input: The messages, or anything else that `client.invoke` accepts.
+    :param on_update: Called with the text so far, e.g. `lambda text: message_placeholder.markdown(text + "▌")`.
+    :param update_interval: The min number of seconds between two updates, as re-rendering every token is slow.
+    :param kwargs: Passed to `client.stream`, e.g. `max_tokens` or `temperature`.
+    :return: The full text and its time to first token, total time and number of tokens.
+    """
+    start = time.perf_counter()
+    time_to_first_token = None
+    last_update = 0.0
+    parts = []
+    n_chunks = 0
+    n_tokens = None
+    for chunk in client.stream(input, **kwargs):
+        # Some providers send the token usage in a separate, empty chunk at the end.
+        if chunk.usage_metadata:
+            n_tokens = chunk.usage_metadata["output_tokens"]
+        if not chunk.content:
+            continue
+
+        now = time.perf_counter()
+        if time_to_first_token is None:
+            time_to_first_token = now - start
+        parts.append(chunk.content)
+        n_chunks += 1
+        if on_update is not None and now - last_update >= update_interval:
+            on_update("".join(parts))
+            last_update = now
+
+    total_time = time.perf_counter() - start
+    content = "".join(parts)
+    if on_update is not None:
+        on_update(content)
+    return StreamedResponse(
+        content=content,
+        time_to_first_token=total_time
+        if time_to_first_token is None
+        else time_to_first_token,
+        total_time=total_time,
+        # Without token usage, every chunk is counted as one token, as OpenAI streams a token per chunk.
+        n_tokens=n_chunks if n_tokens is None else n_tokens,
+    )
+
+
+def format_stream_stats(response: StreamedResponse) -> str:
+    """
+    Format the speed of a streamed response, e.g. to show it below the message.
+    :param response: The streamed response.
+    :return: A short, human readable summary.
+    """
+    return (
+        f"First token after {response.time_to_first_token:.2f} s, "
+        f"{response.n_tokens} tokens at {response.tokens_per_second:.1f} tokens/s"
+    )
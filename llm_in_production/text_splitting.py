@@ -0,0 +1,251 @@
+import re
+import warnings
+from bisect import bisect_left
+from functools import cache
+from typing import Any, Callable
+
+# A span is a (start, end) character range in the text that is being split.
+Span = tuple[int, int]
+# A chunk is a list of spans and the separator that joins them.
+Chunk = tuple[list[Span], str]
+
+
+class RecursiveTokenTextSplitter:
+    """
+    A token-aware version of LangChain's `RecursiveCharacterTextSplitter`.
+
+    The `RecursiveCharacterTextSplitter` calls its `length_function` on every candidate fragment,
+    which means a text is tokenized many times over. This splitter tokenizes every text once,
+    remembers at which character each token starts, and measures a fragment by counting
+    the tokens that start inside it, plus the token it starts in, if any. A token that crosses the boundary
+    of two merged fragments is counted once, so a chunk is measured by the tokens it has in the full text.
+    The separator priority and the overlap semantics are the same as the ones of the
+    `RecursiveCharacterTextSplitter`, but as that splitter re-tokenizes every fragment on its own,
+    which can add a token at a boundary, a chunk can end a few tokens later or earlier.
+    """
+
+    def __init__(
+        self,
+        get_token_offsets: Callable[[str], list[int]],
+        separators: list[str] | None = None,
+        chunk_size: int = 4000,
+        chunk_overlap: int = 200,
+        keep_separator: bool = True,
+        strip_whitespace: bool = True,
+    ):
+        """
+        :param get_token_offsets: A function that tokenizes a text and returns the character offset at which each token starts.
+        :param separators: The separators to split on, in order of priority.
+        :param chunk_size: The max number of tokens per chunk.
+        :param chunk_overlap: The number of overlapping tokens between chunks.
+        :param keep_separator: Whether to keep the separator at the start of the next fragment.
+        :param strip_whitespace: Whether to strip the whitespace from the start and end of every chunk.
+        """
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller."
+            )
+        self._get_token_offsets = get_token_offsets
+        self._separators = separators or ["\n\n", "\n", " ", ""]
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._keep_separator = keep_separator
+        self._strip_whitespace = strip_whitespace
+        self._separator_lengths: dict[str, int] = {}
+
+    @classmethod
+    def from_tiktoken_encoder(
+        cls, model_name: str = "gpt-35-turbo", **kwargs: Any
+    ) -> "RecursiveTokenTextSplitter":
+        """
+        Create a splitter that counts tokens with a local tiktoken encoding.
+        :param model_name: The model whose tokenizer is used.
+        :return: The splitter.
+        """
+
+        def get_token_offsets(text: str) -> list[int]:
+            encoding = _get_tiktoken_encoding(model_name)
+            _, offsets = encoding.decode_with_offsets(encoding.encode(text))
+            return offsets
+
+        return cls(get_token_offsets, **kwargs)
+
+    @classmethod
+    def from_huggingface_tokenizer(
+        cls, tokenizer: Any, **kwargs: Any
+    ) -> "RecursiveTokenTextSplitter":
+        """
+        Create a splitter that counts tokens with a (fast) HuggingFace tokenizer.
+        :param tokenizer: The tokenizer, it must support `return_offsets_mapping`.
+        :return: The splitter.
+        """
+
+        def get_token_offsets(text: str) -> list[int]:
+            encoding = tokenizer(
+                text, add_special_tokens=False, return_offsets_mapping=True
+            )
+            return [start for start, _ in encoding["offset_mapping"]]
+
+        return cls(get_token_offsets, **kwargs)
+
+    def split_text(self, text: str) -> list[str]:
+        """
+        Split a text into chunks of at most `chunk_size` tokens.
+        :param text: The text to split.
+        :return: The chunks.
+        """
+        token_offsets = self._get_token_offsets(text)
+
+        def length(span: Span, continues: bool = False) -> int:
+            # Count the tokens that start inside the span, and the token that the span starts in, if any,
+            # unless the span continues the previous fragment of the chunk, which already counted that token.
+            first_token = bisect_left(token_offsets, span[0])
+            n_tokens = max(bisect_left(token_offsets, span[1]) - first_token, 0)
+            starts_inside_token = first_token > 0 and (
+                first_token == len(token_offsets)
+                or token_offsets[first_token] != span[0]
+            )
+            return n_tokens + (starts_inside_token and not continues)
+
+        chunks = self._split_span(text, (0, len(text)), self._separators, length)
+        return [joined for chunk in chunks if (joined := self._join(text, *chunk))]
+
+    def _split_span(
+        self,
+        text: str,
+        span: Span,
+        separators: list[str],
+        length: Callable[..., int],
+    ) -> list[Chunk]:
+        # Pick the first separator that occurs in the span, like the RecursiveCharacterTextSplitter does.
+        separator = separators[-1]
+        new_separators = []
+        for i, _separator in enumerate(separators):
+            if _separator == "":
+                separator = _separator
+                break
+            if text.find(_separator, *span) != -1:
+                separator = _separator
+                new_separators = separators[i + 1 :]
+                break
+
+        merge_separator = "" if self._keep_separator else separator
+        final_chunks = []
+        good_splits = []
+        for split in self._split_on_separator(text, span, separator):
+            if length(split) < self._chunk_size:
+                good_splits.append(split)
+                continue
+
+            if good_splits:
+                final_chunks.extend(
+                    self._merge_splits(text, good_splits, merge_separator, length)
+                )
+                good_splits = []
+            if not new_separators:
+                final_chunks.append(([split], ""))
+            else:
+                final_chunks.extend(
+                    self._split_span(text, split, new_separators, length)
+                )
+
+        if good_splits:
+            final_chunks.extend(
+                self._merge_splits(text, good_splits, merge_separator, length)
+            )
+        return final_chunks
+
+    def _split_on_separator(self, text: str, span: Span, separator: str) -> list[Span]:
+        start, end = span
+        if separator == "":
+            return [(i, i + 1) for i in range(start, end)]
+
+        pattern = re.compile(re.escape(separator))
+        matches = [m.span() for m in pattern.finditer(text, start, end)]
+        if self._keep_separator:
+            # The separator is kept at the start of the next fragment.
+            boundaries = [start, *(m_start for m_start, _ in matches), end]
+            splits = list(zip(boundaries[:-1], boundaries[1:]))
+        else:
+            boundaries = [(start, start), *matches, (end, end)]
+            splits = [
+                (prev_end, next_start)
+                for (_, prev_end), (next_start, _) in zip(boundaries, boundaries[1:])
+            ]
+        return [(s, e) for s, e in splits if e > s]
+
+    def _merge_splits(
+        self,
+        text: str,
+        splits: list[Span],
+        separator: str,
+        length: Callable[..., int],
+    ) -> list[Chunk]:
+        # Merge the splits into chunks of at most chunk_size tokens,
+        # carrying over up to chunk_overlap tokens from the previous chunk.
+        separator_len = self._get_separator_length(separator)
+        chunks = []
+        current_chunk: list[Span] = []
+        # The number of tokens that every split of the current chunk adds to it.
+        split_lengths: list[int] = []
+        total = 0
+        for split in splits:
+            # A split that directly follows the previous one shares the token that crosses their boundary.
+            continues = bool(current_chunk) and current_chunk[-1][1] == split[0]
+            split_len = length(split, continues)
+            if (
+                total + split_len + (separator_len if current_chunk else 0)
+                > self._chunk_size
+            ):
+                if total > self._chunk_size:
+                    warnings.warn(
+                        f"Created a chunk of size {total}, which is longer than the specified {self._chunk_size}"
+                    )
+                if current_chunk:
+                    chunks.append(current_chunk)
+                    while total > self._chunk_overlap or (
+                        total + split_len + (separator_len if current_chunk else 0)
+                        > self._chunk_size
+                        and total > 0
+                    ):
+                        total -= split_lengths[0] + (
+                            separator_len if len(current_chunk) > 1 else 0
+                        )
+                        current_chunk = current_chunk[1:]
+                        split_lengths = split_lengths[1:]
+                        if current_chunk:
+                            # The new first split no longer shares its first token with a previous split.
+                            full_len = length(current_chunk[0])
+                            total += full_len - split_lengths[0]
+                            split_lengths[0] = full_len
+                    if not current_chunk:
+                        split_len = length(split)
+            current_chunk = current_chunk + [split]
+            split_lengths = split_lengths + [split_len]
+            total += split_len + (separator_len if len(current_chunk) > 1 else 0)
+
+        if current_chunk:
+            chunks.append(current_chunk)
+        return [(chunk, separator) for chunk in chunks]
+
+    def _join(self, text: str, spans: list[Span], separator: str) -> str:
+        if self._keep_separator:
+            # With the separators kept, consecutive splits are adjacent in the text.
+            joined = text[spans[0][0] : spans[-1][1]]
+        else:
+            joined = separator.join(text[start:end] for start, end in spans)
+        return joined.strip() if self._strip_whitespace else joined
+
+    def _get_separator_length(self, separator: str) -> int:
+        if not separator:
+            return 0
+        if separator not in self._separator_lengths:
+            self._separator_lengths[separator] = len(self._get_token_offsets(separator))
+        return self._separator_lengths[separator]
+
+
+@cache
+def _get_tiktoken_encoding(model_name: str):
+    from tiktoken import encoding_for_model
+
+    return encoding_for_model(model_name)
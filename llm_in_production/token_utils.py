@@ -0,0 +1,126 @@
+import hashlib
+import json
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Any, Callable, NamedTuple
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class TokenCountCache:
+    """
+    A bounded LRU cache for the number of tokens in a message.
+    The cache is keyed by the counter, the model and a hash of the message, so a chat history only
+    has to be tokenized once; later calls only pay for the messages that were added since.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        """
+        :param maxsize: The maximum number of token counts to keep in memory.
+        """
+        self.maxsize = maxsize
+        self._counts: OrderedDict[tuple[str, str, str], int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_num_tokens(
+        self, counter: str, model: str, message: Any, count: Callable[[Any], int]
+    ) -> int:
+        """
+        Get the number of tokens in a message, counting it only if it is not cached yet.
+        :param counter: The name of the way `count` counts, e.g. "openai_chat" for the content and the chat format
+            overhead, or "langchain" for the content only, so counts of different counters are never mixed up.
+        :param model: The name of the model whose tokenizer is used.
+        :param message: The message as a dict or a LangChain message.
+        :param count: The function that counts the tokens of the message on a cache miss.
+        :return: The number of tokens in the message.
+        """
+        key = (counter, model, hash_message(message))
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return self._counts[key]
+            self.misses += 1
+
+        n_tokens = count(message)
+
+        with self._lock:
+            self._counts[key] = n_tokens
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+        return n_tokens
+
+    def cache_info(self) -> CacheInfo:
+        """Report the hit and miss counts, like `functools.lru_cache`."""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._counts))
+
+    def cache_clear(self) -> None:
+        """Remove all token counts and reset the statistics."""
+        with self._lock:
+            self._counts.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# The cache that is shared by `openai_utils` and `rag_utils`.
+token_count_cache = TokenCountCache()
+
+
+def get_role_and_content(message: Any) -> tuple[str, str]:
+    """
+    Get the role and the content of a message.
+    :param message: The message as a dict in the OpenAI chat format or a LangChain message.
+    :return: A tuple of the role and the content.
+    """
+    if isinstance(message, dict):
+        return message["role"], message["content"]
+    return message.type, message.content
+
+
+def hash_message(message: Any) -> str:
+    """
+    Hash a message such that identical messages get the same key.
+    :param message: The message as a dict or a LangChain message.
+    :return: A hex digest of the message.
+    """
+    if isinstance(message, dict):
+        fields = sorted(message.items())
+    else:
+        fields = [
+            ("role", message.type),
+            ("content", message.content),
+            # Two AI messages with the same content can still call different tools.
+            ("tool_calls", getattr(message, "tool_calls", None)),
+            ("tool_call_id", getattr(message, "tool_call_id", None)),
+        ]
+    digest = hashlib.blake2b(digest_size=16)
+    for key, value in fields:
+        if not isinstance(value, str):
+            value = json.dumps(value, sort_keys=True, default=str)
+        digest.update(f"{key}\x00{value}\x00".encode())
+    return digest.hexdigest()
+
+
+def get_start_index_within_budget(n_tokens_per_message: list[int], budget: int) -> int:
+    """
+    Find the first message to keep such that the remaining messages fit into the budget.
+    :param n_tokens_per_message: The number of tokens of each message, oldest first.
+    :param budget: The number of tokens that the kept messages may use.
+    :return: The index of the oldest message to keep.
+    """
+    # prefix_sums[i] is the number of tokens in the first i messages,
+    # so keeping messages[i:] costs total - prefix_sums[i] tokens.
+    prefix_sums = [0, *accumulate(n_tokens_per_message)]
+    total = prefix_sums[-1]
+    return bisect_left(prefix_sums, total - budget)
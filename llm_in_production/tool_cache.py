@@ -0,0 +1,229 @@
+import asyncio
+import functools
+import inspect
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, NamedTuple
+
+
+class ToolCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    # Calls that waited for an identical call that was already in progress, instead of calling the API too.
+    coalesced: int
+    max_entries: int
+    currsize: int
+
+    @property
+    def hit_rate(self) -> float:
+        n_calls = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / n_calls if n_calls else 0.0
+
+
+def normalize_argument(value: Any) -> Any:
+    """
+    Normalize an argument of a tool, so arguments that mean the same share a cache entry.
+    :param value: The argument, e.g. "msft " or "Amsterdam".
+    :return: The argument, stripped and lowercased if it is a string, e.g. "msft" or "amsterdam".
+    """
+    if isinstance(value, str):
+        return value.strip().casefold()
+    return value
+
+
+class _ToolCache:
+    """The cached results of one tool, see `ttl_cache`."""
+
+    def __init__(
+        self,
+        function: Callable,
+        ttl: float,
+        max_entries: int,
+        normalize: Callable[[Any], Any],
+    ):
+        self.function = function
+        self.signature = inspect.signature(function)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.normalize = normalize
+        # The key of the arguments to the time the result expires and the result.
+        self.results: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        # The key of the arguments to the result of the call that is in progress.
+        self.in_progress: dict[Any, Future | asyncio.Future] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_key(self, args: tuple, kwargs: dict) -> str:
+        arguments = self.signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        normalized = {
+            name: self.normalize(value) for name, value in arguments.arguments.items()
+        }
+        return json.dumps(normalized, sort_keys=True, default=str)
+
+    def get_result(self, key: str) -> tuple[bool, Any]:
+        # Must be called with the lock held.
+        cached = self.results.get(key)
+        if cached is None:
+            return False, None
+        expires, result = cached
+        if expires < time.monotonic():
+            del self.results[key]
+            return False, None
+        self.results.move_to_end(key)
+        self.hits += 1
+        return True, result
+
+    def set_result(self, key: str, result: Any) -> None:
+        # Must be called with the lock held.
+        self.results[key] = (time.monotonic() + self.ttl, result)
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+    def call(self, args: tuple, kwargs: dict) -> Any:
+        key = self.get_key(args, kwargs)
+        with self.lock:
+            found, result = self.get_result(key)
+            if found:
+                return result
+            future = self.in_progress.get(key)
+            if future is not None:
+                self.coalesced += 1
+                is_owner = False
+            else:
+                self.misses += 1
+                future = self.in_progress[key] = Future()
+                is_owner = True
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = self.function(*args, **kwargs)
+        except BaseException as e:
+            with self.lock:
+                del self.in_progress[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.set_result(key, result)
+            del self.in_progress[key]
+        future.set_result(result)
+        return result
+
+    async def acall(self, args: tuple, kwargs: dict) -> Any:
+        key = self.get_key(args, kwargs)
+        # An asyncio future can only be awaited on its own event loop.
+        loop = asyncio.get_running_loop()
+        progress_key = (id(loop), key)
+        with self.lock:
+            found, result = self.get_result(key)
+            if found:
+                return result
+            future = self.in_progress.get(progress_key)
+            if future is not None:
+                self.coalesced += 1
+                is_owner = False
+            else:
+                self.misses += 1
+                future = self.in_progress[progress_key] = loop.create_future()
+                is_owner = True
+        if not is_owner:
+            # Shield the shared future, so a waiter that is cancelled does not cancel the call for the others.
+            return await asyncio.shield(future)
+
+        try:
+            result = await self.function(*args, **kwargs)
+        except BaseException as e:
+            with self.lock:
+                del self.in_progress[progress_key]
+            future.set_exception(e)
+            # Mark the exception as retrieved, in case no other call was waiting for it.
+            future.exception()
+            raise
+        with self.lock:
+            self.set_result(key, result)
+            del self.in_progress[progress_key]
+        future.set_result(result)
+        return result
+
+    def cache_info(self) -> ToolCacheInfo:
+        with self.lock:
+            return ToolCacheInfo(
+                self.hits,
+                self.misses,
+                self.coalesced,
+                self.max_entries,
+                len(self.results),
+            )
+
+    def cache_clear(self) -> None:
+        with self.lock:
+            self.results.clear()
+            self.hits = 0
+            self.misses = 0
+            self.coalesced = 0
+
+
+# The caches of all cached tools of this process, by the name of the tool.
+_tool_caches: weakref.WeakValueDictionary[
+    str, _ToolCache
+] = weakref.WeakValueDictionary()
+
+
+def ttl_cache(
+    ttl: float,
+    max_entries: int = 256,
+    normalize: Callable[[Any], Any] = normalize_argument,
+) -> Callable[[Callable], Callable]:
+    """
+    Cache the results of a tool for `ttl` seconds, e.g. `@ttl_cache(ttl=60)` above `get_stock_prices`.
+
+    Calls with the same normalized arguments share a result, so an agent that asks for the weather in
+    "Amsterdam" and later in "amsterdam " calls the weather API once. Identical calls that arrive while
+    the first one is still in progress wait for its result instead of calling the API as well.
+    Errors are not cached. Works for both functions and async functions, the cached results are shared
+    by all callers and must not be modified.
+    :param ttl: The number of seconds a result stays valid.
+    :param max_entries: The max number of results to keep, the least recently used is dropped first.
+    :param normalize: Normalizes every argument before it is used in the key.
+    :return: The decorator. The decorated tool has `cache_info()` and `cache_clear()`, like `functools.lru_cache`.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        cache = _ToolCache(function, ttl, max_entries, normalize)
+
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                return await cache.acall(args, kwargs)
+
+        else:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                return cache.call(args, kwargs)
+
+        wrapper.cache_info = cache.cache_info
+        wrapper.cache_clear = cache.cache_clear
+        # Keep the cache alive as long as the tool is.
+        wrapper._tool_cache = cache
+        _tool_caches[function.__qualname__] = cache
+        return wrapper
+
+    return decorator
+
+
+def get_tool_cache_infos() -> dict[str, ToolCacheInfo]:
+    """
+    Get the statistics of all cached tools, e.g. to show their hit rates in a dashboard.
+    :return: The statistics by the name of the tool.
+    """
+    return {name: cache.cache_info() for name, cache in list(_tool_caches.items())}
@@ -1,12 +1,8 @@
 from collections import Counter
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import plotly.express as px
-import seaborn as sns
-from sklearn.cluster import KMeans
-from sklearn.manifold import TSNE
+
+# The plotting and clustering libraries take seconds to import, so they are imported by the functions that use them.
 
 
 def plot_probabilities(
@@ -21,6 +17,8 @@ def plot_probabilities(
     :param word_probs: The probabilities for each word.
     :param renormalize: # If true, it shows the probabilities as to how they will be sampled. If false, it shows the original probabilities.
     """
+    import matplotlib.pyplot as plt
+
     if renormalize:
         # rescale the probs to ensure sum(word_probs) == 1.0
         word_probs = normalize_probs(word_probs)
@@ -59,6 +57,10 @@ def plot_embeddings_interactively(
     :param plot_title: The title of the plot.
     :param n_cluster: The number of cluster/different colors to use in the plot.
     """
+    import pandas as pd
+    import plotly.express as px
+    from sklearn.cluster import KMeans
+    from sklearn.manifold import TSNE
 
     # First, we cluster the embeddings using k-means such that can show some groups in the plot.
     kmeans = KMeans(n_clusters=n_cluster, init="k-means++", random_state=42, n_init=10)
@@ -113,6 +115,9 @@ def plot_similarity_head_map(
     assert (
         similarities.shape[0] == similarities.shape[1] == len(titles)
     ), f"The similarity matrix should be square and have the same length as the titles but got {similarities.shape} and {len(titles)}"
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import seaborn as sns
 
     # Convert the similarity matrix into a DataFrame
     similarity_df = pd.DataFrame(similarities, index=titles, columns=titles)
@@ -0,0 +1,111 @@
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from llm_in_production.rag_utils import FaissIndexSpec
+
+
+def main():
+    args = arg_parser()
+    corpus, queries = make_clustered_data(
+        args.n_corpus, args.n_queries, args.n_features, args.n_clusters
+    )
+
+    flat_index = FaissIndexSpec(kind="flat").create_index(corpus)
+    flat_index.add(corpus)
+    flat_latency, exact_neighbours = search(flat_index, queries, args.k)
+    print(f"{args.n_corpus} vectors, {args.n_queries} queries, recall@{args.k}")
+    print(f"{'index':<12} {'param':<14} {'build (s)':>9} {'ms/query':>9} {'recall':>7}")
+    print(f"{'flat':<12} {'-':<14} {'-':>9} {flat_latency:>9.3f} {1.0:>7.3f}")
+
+    runs = [
+        ("ivf_flat", "nprobe", [1, 4, 16, 64]),
+        ("hnsw", "efSearch", [16, 64, 256]),
+        ("ivf_pq", "nprobe", [1, 4, 16, 64]),
+    ]
+    for kind, param_name, param_values in runs:
+        spec = FaissIndexSpec(
+            kind=kind,
+            n_lists=args.n_lists,
+            pq_m=args.pq_m,
+            training_sample_size=args.training_sample_size,
+        )
+        start = time.perf_counter()
+        index = spec.create_index(corpus)
+        index.add(corpus)
+        build_time = time.perf_counter() - start
+
+        for value in param_values:
+            set_search_param(index, value)
+            latency, neighbours = search(index, queries, args.k)
+            recall = recall_at_k(exact_neighbours, neighbours)
+            print(
+                f"{kind:<12} {f'{param_name}={value}':<14} {build_time:>9.2f} {latency:>9.3f} {recall:>7.3f}"
+            )
+
+
+def make_clustered_data(
+    n_corpus: int, n_queries: int, n_features: int, n_clusters: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Create normalized vectors that are grouped in clusters, like the embeddings of talks on related topics.
+    :return: The corpus of shape (n_corpus, n_features) and the queries of shape (n_queries, n_features).
+    """
+    rng = np.random.default_rng(42)
+    centers = rng.normal(size=(n_clusters, n_features))
+    assignments = rng.integers(n_clusters, size=n_corpus + n_queries)
+    vectors = centers[assignments] + 0.5 * rng.normal(
+        size=(n_corpus + n_queries, n_features)
+    )
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors.astype(np.float32)
+    return vectors[:n_corpus], vectors[n_corpus:]
+
+
+def set_search_param(index, value: int) -> None:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        index = faiss.downcast_index(index.base_index)
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = value
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = value
+
+
+def search(index, queries: np.ndarray, k: int) -> tuple[float, np.ndarray]:
+    """
+    Search the queries one by one, like the Q&A bot does.
+    :return: The average latency in milliseconds and the neighbours of every query.
+    """
+    neighbours = []
+    start = time.perf_counter()
+    for query in queries:
+        _, indices = index.search(query[None, :], k)
+        neighbours.append(indices[0])
+    latency = (time.perf_counter() - start) / len(queries) * 1000
+    return latency, np.array(neighbours)
+
+
+def recall_at_k(exact: np.ndarray, approximate: np.ndarray) -> float:
+    """The fraction of the exact top k neighbours that the approximate index also returned."""
+    hits = [len(set(e).intersection(a)) for e, a in zip(exact, approximate)]
+    return sum(hits) / exact.size
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_corpus", type=int, default=50_000)
+    parser.add_argument("--n_queries", type=int, default=200)
+    parser.add_argument("--n_features", type=int, default=384)
+    parser.add_argument("--n_clusters", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n_lists", type=int, default=256)
+    parser.add_argument("--pq_m", type=int, default=16)
+    parser.add_argument("--training_sample_size", type=int, default=25_000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import random
+import time
+
+from llm_in_production.fake_chat_model import FakeChatModel
+from llm_in_production.llm import batch_invoke
+
+
+def main():
+    args = arg_parser()
+    random.seed(42)
+    prompts = [f"Describe house {i}" for i in range(args.n_prompts)]
+
+    client = FakeChatModel(latency=args.latency)
+    start = time.perf_counter()
+    sequential = [client.invoke(prompt) for prompt in prompts]
+    sequential_time = time.perf_counter() - start
+
+    client = FakeChatModel(
+        latency=args.latency, rate_limit_probability=args.rate_limit_probability
+    )
+    start = time.perf_counter()
+    batched = asyncio.run(
+        batch_invoke(
+            client,
+            prompts,
+            max_concurrency=args.max_concurrency,
+            initial_delay=args.latency,
+        )
+    )
+    batched_time = time.perf_counter() - start
+
+    print(f"{args.n_prompts} prompts with a latency of {args.latency * 1000:.0f} ms:")
+    print(f"  sequential invoke: {sequential_time:.2f} s")
+    print(
+        f"  batch_invoke:      {batched_time:.2f} s ({sequential_time / batched_time:.1f}x),"
+        f" max_concurrency={args.max_concurrency},"
+        f" {args.rate_limit_probability:.0%} of the requests rate limited"
+    )
+    same_order = [m.content for m in batched] == [m.content for m in sequential]
+    print(f"  same results in the same order: {same_order}")
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_prompts", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--max_concurrency", type=int, default=10)
+    parser.add_argument("--rate_limit_probability", type=float, default=0.1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import numpy as np
+
+from llm_in_production.numpy_utils import (
+    cosine_similarity,
+    cosine_similarity_matrix,
+    top_k_cosine_similarity,
+)
+
+
+def main():
+    args = arg_parser()
+    rng = np.random.default_rng(42)
+    # all-MiniLM-L6-v2 embeddings have 384 features.
+    corpus = rng.normal(size=(args.n_corpus, args.n_features)).astype(np.float32)
+    queries = rng.normal(size=(args.n_queries, args.n_features)).astype(np.float32)
+
+    looped_time, looped_matrix = timed(
+        lambda: looped_similarity_matrix(queries, corpus)
+    )
+    matrix_time, matrix = timed(lambda: cosine_similarity_matrix(queries, corpus))
+    print(f"Similarity matrix of {args.n_queries} x {args.n_corpus} vectors:")
+    print(f"  looped:     {looped_time * 1000:.1f} ms")
+    print(
+        f"  vectorized: {matrix_time * 1000:.1f} ms ({looped_time / matrix_time:.0f}x)"
+    )
+    print(f"  max abs difference: {np.abs(looped_matrix - matrix).max():.2e}")
+
+    looped_time, looped_top_k = timed(
+        lambda: looped_top_k_search(queries, corpus, args.k)
+    )
+    top_k_time, (top_k, _) = timed(
+        lambda: top_k_cosine_similarity(queries, corpus, args.k)
+    )
+    print(f"Top {args.k} search of {args.n_queries} queries:")
+    print(f"  looped:     {looped_time * 1000:.1f} ms")
+    print(f"  vectorized: {top_k_time * 1000:.1f} ms ({looped_time / top_k_time:.0f}x)")
+    print(f"  same results: {(looped_top_k == top_k).all()}")
+
+
+def looped_similarity_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """The Python double loop over `cosine_similarity` that is used in the notebooks."""
+    similarities = np.zeros((len(a), len(b)))
+    for i, a_i in enumerate(a):
+        for j, b_j in enumerate(b):
+            similarities[i, j] = cosine_similarity(a_i, b_j)
+    return similarities
+
+
+def looped_top_k_search(queries: np.ndarray, corpus: np.ndarray, k: int) -> np.ndarray:
+    """The per-row loop that scores every corpus vector for a query and sorts the scores."""
+    top_k = []
+    for query in queries:
+        scores = [cosine_similarity(query, vector) for vector in corpus]
+        top_k.append(np.argsort(scores)[::-1][:k])
+    return np.array(top_k)
+
+
+def timed(func) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_corpus", type=int, default=5000)
+    parser.add_argument("--n_queries", type=int, default=20)
+    parser.add_argument("--n_features", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
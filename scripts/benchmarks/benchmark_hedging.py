@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from llm_in_production.fake_chat_model import FakeChatModel
+from llm_in_production.hedging import HedgedChatModel
+
+
+def main():
+    args = arg_parser()
+    random.seed(42)
+
+    def create_backend(prefix: str) -> FakeChatModel:
+        return FakeChatModel(
+            latency=args.latency,
+            tail_latency=args.tail_latency,
+            tail_probability=args.tail_probability,
+            error_probability=args.error_probability,
+            prefix=prefix,
+        )
+
+    single = create_backend("a: ")
+    hedged = HedgedChatModel(
+        backends=[create_backend("a: "), create_backend("b: ")],
+        hedge_delay=args.hedge_delay,
+    )
+    print(
+        f"{args.n_calls} calls with a latency of {args.latency * 1000:.0f} ms,"
+        f" {args.tail_probability:.0%} of them take {args.tail_latency * 1000:.0f} ms"
+        f" and {args.error_probability:.0%} fail:"
+    )
+    for name, client in [("single backend", single), ("hedged", hedged)]:
+        latencies, n_errors = asyncio.run(
+            measure(client, args.n_calls, args.max_concurrency)
+        )
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        print(
+            f"  {name:15} p50 {p50:4.0f} ms, p95 {p95:4.0f} ms, p99 {p99:4.0f} ms,"
+            f" {n_errors} errors"
+        )
+    average_latencies = ", ".join(
+        f"{latency * 1000:.0f} ms" for latency in hedged.backend_latencies()
+    )
+    print(f"  moving average latency of the hedged backends: {average_latencies}")
+
+
+async def measure(client, n_calls: int, max_concurrency: int) -> tuple[np.ndarray, int]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def call(i: int) -> float | None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await client.ainvoke(f"Describe house {i}")
+            except RuntimeError:
+                return None
+            return time.perf_counter() - start
+
+    results = await asyncio.gather(*(call(i) for i in range(n_calls)))
+    latencies = np.array([latency for latency in results if latency is not None])
+    return latencies, results.count(None)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_calls", type=int, default=500)
+    parser.add_argument("--max_concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--tail_latency", type=float, default=1.0)
+    parser.add_argument("--tail_probability", type=float, default=0.1)
+    parser.add_argument("--error_probability", type=float, default=0.02)
+    parser.add_argument("--hedge_delay", type=float, default=0.15)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
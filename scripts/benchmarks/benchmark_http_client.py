@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import time
+
+import httpx
+import requests
+from stub_api_server import StubApiServer
+
+from llm_in_production.http_client import aget_json, get_json
+
+
+def main():
+    args = arg_parser()
+    stub = StubApiServer(latency=args.latency, error_probability=args.error_probability)
+    url = f"{stub.url}/current.json"
+    params = {"key": "stub", "q": "Amsterdam"}
+
+    def call_without_pool():
+        # What the agent tools did before: a new connection for every call, no timeout and no retries.
+        return requests.get(url, params=params).json()
+
+    def call_with_pool():
+        return get_json(url, params=params, initial_delay=0.01)
+
+    print(
+        f"{args.n_calls} sequential calls to a local stub API,"
+        f" {args.latency * 1000:.0f} ms per call, {args.error_probability:.0%} fail with a 503:"
+    )
+    for name, call in [
+        ("requests.get", call_without_pool),
+        ("pooled get_json", call_with_pool),
+    ]:
+        n_errors = 0
+        start = None
+        # The first call opens the connection of the pool, so it is not measured.
+        for i in range(args.n_calls + 1):
+            if i == 1:
+                stub.n_requests = 0
+                n_errors = 0
+                start = time.perf_counter()
+            try:
+                call()
+            except (ValueError, httpx.HTTPStatusError):
+                # The body of a 503 is not JSON, `get_json` raises it when the retries run out.
+                n_errors += 1
+        elapsed = (time.perf_counter() - start) / args.n_calls
+        print(
+            f"  {name:16} {elapsed * 1000:6.2f} ms per call,"
+            f" {stub.n_requests} requests, {n_errors} failed calls"
+        )
+
+    async def call_concurrently() -> float:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                aget_json(url, params=params, initial_delay=0.01)
+                for _ in range(args.n_calls)
+            ),
+            return_exceptions=True,
+        )
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(call_concurrently())
+    print(f"  {'async aget_json':16} {elapsed:6.2f} s for all calls at the same time")
+    stub.close()
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error_probability", type=float, default=0.05)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parents[2]
+
+# The modules that the notebooks and the Streamlit apps import.
+ENTRY_POINTS = [
+    "llm_in_production.llm",
+    "llm_in_production.openai_utils",
+    "llm_in_production.token_utils",
+    "llm_in_production.text_splitting",
+    "llm_in_production.rag_utils",
+    "llm_in_production.hybrid_search",
+    "llm_in_production.agent_utils",
+    "llm_in_production.agent_tools",
+    "llm_in_production.streaming",
+    "llm_in_production.instrumentation",
+    "llm_in_production.visualization_utils",
+    "llm_in_production.huggingface_utils",
+]
+
+# Dependencies that take long to import, which an entry point should only pay for if it uses them.
+HEAVY_MODULES = [
+    "torch",
+    "transformers",
+    "matplotlib",
+    "seaborn",
+    "plotly",
+    "sklearn",
+    "pandas",
+    "langchain_openai",
+    "langchain_google_vertexai",
+    "openai",
+    "tiktoken",
+    "faiss",
+]
+
+MEASURE_IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+heavy = [name for name in {heavy_modules!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "heavy": heavy}}))
+"""
+
+
+def main():
+    args = arg_parser()
+    modules = [args.module] if args.module else ENTRY_POINTS
+    print(f"Import time of a fresh interpreter, median of {args.repeat} runs:")
+    for module in modules:
+        result = measure_import(module, args.repeat)
+        if result is None:
+            print(f"  {module:40}  failed, a dependency is not installed")
+            continue
+        seconds, heavy = result
+        print(f"  {module:40} {seconds * 1000:6.0f} ms  {', '.join(heavy) or '-'}")
+
+
+def measure_import(module: str, repeat: int) -> tuple[float, list[str]] | None:
+    """
+    Measure how long it takes to import a module in a new Python process, so nothing is imported yet.
+    :param module: The module.
+    :param repeat: The number of processes to start.
+    :return: The median number of seconds and the heavy dependencies that were imported,
+        or None if the import failed.
+    """
+    code = MEASURE_IMPORT.format(module=module, heavy_modules=HEAVY_MODULES)
+    timings = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True
+        )
+        if process.returncode != 0:
+            return None
+        result = json.loads(process.stdout.splitlines()[-1])
+        timings.append(result["seconds"])
+    return statistics.median(timings), result["heavy"]
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", type=str, default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+from functools import cache
+from pathlib import Path
+
+from llm_in_production.hybrid_search import BM25Index
+from llm_in_production.rag_utils import (
+    build_or_update_faiss_index,
+    load_faiss_index,
+    save_faiss_index,
+)
+
+DATA_PATH = Path(__file__).parents[2] / "solutions" / "03_RAG" / "pydata.json"
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+def main():
+    """
+    Compare the memory of the PyData bot when every session loads its own embedding model and index,
+    like it did with `st.session_state`, with sharing them between sessions, like `st.cache_resource` does.
+    Every measurement runs in a new process, so they do not see each other's memory.
+    """
+    args = arg_parser()
+    if args.child:
+        print(measure_sessions(args))
+        return
+
+    with tempfile.TemporaryDirectory() as index_path:
+        build_index(Path(index_path), args.fake_embeddings)
+        model = "fake embeddings" if args.fake_embeddings else EMBEDDING_MODEL_NAME
+        print(f"Memory of the embedding model ({model}) and the index of the sessions:")
+        print(f"{'sessions':>8} {'per session (MB)':>17} {'shared (MB)':>12}")
+        for n_sessions in [1, args.n_sessions]:
+            per_session, shared = [
+                run_child(args, index_path, n_sessions, strategy)
+                for strategy in ["per_session", "shared"]
+            ]
+            print(f"{n_sessions:>8} {per_session:>17.1f} {shared:>12.1f}")
+
+
+def create_embeddings(fake_embeddings: bool):
+    if fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        return DeterministicFakeEmbedding(size=384)
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+def build_index(path: Path, fake_embeddings: bool) -> None:
+    with open(DATA_PATH) as f:
+        talks = json.load(f)["talks"]
+    texts = []
+    metadatas = []
+    for talk in talks:
+        metadata = {"title": talk["title"]}
+        for paragraph in f"{talk['abstract']}\n\n{talk['description']}".split("\n\n"):
+            if paragraph.strip():
+                texts.append(paragraph.strip())
+                metadatas.append(metadata)
+    db = build_or_update_faiss_index(
+        texts, metadatas, create_embeddings(fake_embeddings)
+    )
+    save_faiss_index(db, path, bm25_index=BM25Index.from_faiss(db))
+
+
+def run_child(args, index_path: str, n_sessions: int, strategy: str) -> float:
+    command = [
+        sys.executable,
+        __file__,
+        "--child",
+        "--index_path",
+        index_path,
+        "--n_sessions",
+        str(n_sessions),
+        "--strategy",
+        strategy,
+    ]
+    if args.fake_embeddings:
+        command.append("--fake_embeddings")
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return float(output.splitlines()[-1])
+
+
+def measure_sessions(args) -> float:
+    """
+    Simulate the sessions in this process and measure how much the memory grew.
+    :return: The growth in MB.
+    """
+
+    def load():
+        embeddings = create_embeddings(args.fake_embeddings)
+        db = load_faiss_index(Path(args.index_path), embeddings)
+        return db, BM25Index.load(Path(args.index_path))
+
+    get_index = cache(load) if args.strategy == "shared" else load
+    baseline = get_memory()
+    sessions = []
+    for i in range(args.n_sessions):
+        db, bm25_index = get_index()
+        db.similarity_search(f"question {i}", k=3)
+        bm25_index.search(f"question {i}", k=3)
+        sessions.append({"messages": [], "db": db, "bm25_index": bm25_index})
+    return get_memory() - baseline
+
+
+def get_memory() -> float:
+    """Get the resident memory of this process in MB, or its peak where /proc is not available."""
+    statm = Path("/proc/self/statm")
+    if statm.exists():
+        n_pages = int(statm.read_text().split()[1])
+        return n_pages * resource.getpagesize() / 1024**2
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports the peak in bytes.
+    return peak / 1024**2
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_sessions", type=int, default=20)
+    parser.add_argument(
+        "--fake_embeddings",
+        action="store_true",
+        help="Only measure the index, e.g. without sentence-transformers installed",
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--index_path", type=str, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--strategy", choices=["per_session", "shared"], help=argparse.SUPPRESS
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
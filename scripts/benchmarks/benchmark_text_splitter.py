@@ -0,0 +1,112 @@
+import argparse
+import json
+import sys
+import time
+import warnings
+from pathlib import Path
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from tiktoken import encoding_for_model
+
+from llm_in_production.text_splitting import RecursiveTokenTextSplitter
+
+REPO_ROOT = Path(__file__).parents[2]
+SEPARATORS = ["\n\n", "\n", ".", "?", "!", " ", ""]
+
+
+def main():
+    args = arg_parser()
+    with open(args.data, "r") as f:
+        talks = json.load(f)["talks"]
+    texts = [text for talk in talks for text in (talk["abstract"], talk["description"])]
+
+    encoding = encoding_for_model(args.model_name)
+    n_tokenizer_calls = 0
+
+    def get_num_tokens(text: str) -> int:
+        nonlocal n_tokenizer_calls
+        n_tokenizer_calls += 1
+        return len(encoding.encode(text))
+
+    baseline = RecursiveCharacterTextSplitter(
+        separators=SEPARATORS,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        length_function=get_num_tokens,
+        keep_separator=True,
+        strip_whitespace=True,
+    )
+    token_splitter = RecursiveTokenTextSplitter.from_tiktoken_encoder(
+        args.model_name,
+        separators=SEPARATORS,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        keep_separator=True,
+        strip_whitespace=True,
+    )
+
+    baseline_time, baseline_chunks = benchmark(baseline.split_text, texts, args.repeat)
+    token_time, token_chunks = benchmark(token_splitter.split_text, texts, args.repeat)
+
+    n_equal = sum(a == b for a, b in zip(baseline_chunks, token_chunks))
+    print(f"Split {len(texts)} texts from {args.data.name} ({args.repeat} repeats)")
+    print(
+        f"RecursiveCharacterTextSplitter: {baseline_time * 1000:.1f} ms per pass, "
+        f"{n_tokenizer_calls // args.repeat} tokenizer calls per pass"
+    )
+    print(
+        f"RecursiveTokenTextSplitter:     {token_time * 1000:.1f} ms per pass, "
+        f"{len(texts)} tokenizer calls per pass"
+    )
+    print(f"Speed-up: {baseline_time / token_time:.1f}x")
+    print(f"Texts with identical chunks: {n_equal}/{len(texts)}")
+    if n_equal < len(texts):
+        chunk_lengths = [
+            (
+                [len(encoding.encode(chunk)) for chunk in baseline],
+                [len(encoding.encode(chunk)) for chunk in token],
+            )
+            for baseline, token in zip(baseline_chunks, token_chunks)
+            if baseline != token
+        ]
+        warnings.warn(
+            f"{len(texts) - n_equal} texts are split differently, the tokens per chunk of the first ones"
+            f" (RecursiveCharacterTextSplitter vs RecursiveTokenTextSplitter): {chunk_lengths[:5]}"
+        )
+        if args.strict:
+            sys.exit(1)
+
+
+def benchmark(split_text, texts: list[str], repeat: int) -> tuple[float, list]:
+    """
+    Time how long it takes to split all texts.
+    :param split_text: The function that splits a text into chunks.
+    :param texts: The texts to split.
+    :param repeat: The number of passes over the texts.
+    :return: The average time per pass in seconds and the chunks of the last pass.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        chunks = [split_text(text) for text in texts]
+    return (time.perf_counter() - start) / repeat, chunks
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data", type=Path, default=REPO_ROOT / "solutions" / "03_RAG" / "pydata.json"
+    )
+    parser.add_argument("--model_name", type=str, default="gpt-35-turbo")
+    parser.add_argument("--chunk_size", type=int, default=150)
+    parser.add_argument("--chunk_overlap", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Fail if any text is split differently than by the RecursiveCharacterTextSplitter",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stub_api_server import StubApiServer
+
+
+def main():
+    args = arg_parser()
+    stub = StubApiServer(latency=args.latency)
+    # The tools read the URLs of the APIs when they are imported.
+    os.environ["WEATHER_API_URL"] = stub.url
+    os.environ.setdefault("WEATHER_API_KEY", "stub")
+    from llm_in_production.agent_tools import get_current_weather
+
+    # Users and agent iterations ask for the weather of a few cities, in different spellings.
+    cities = ["Amsterdam", "amsterdam ", "Utrecht", "AMSTERDAM", "utrecht"]
+    locations = [cities[i % len(cities)] for i in range(args.n_calls)]
+
+    def call_all(function) -> float:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.max_concurrency) as executor:
+            list(executor.map(function, locations))
+        return time.perf_counter() - start
+
+    uncached_time = call_all(get_current_weather.__wrapped__)
+    uncached_requests = stub.n_requests
+    stub.n_requests = 0
+    cached_time = call_all(get_current_weather)
+
+    info = get_current_weather.cache_info()
+    print(
+        f"{args.n_calls} weather calls for {len(cities)} spellings of 2 cities,"
+        f" {args.max_concurrency} at a time, {args.latency * 1000:.0f} ms per API call:"
+    )
+    print(f"  without cache: {uncached_time:.2f} s, {uncached_requests} API requests")
+    print(f"  with cache:    {cached_time:.2f} s, {stub.n_requests} API requests")
+    print(
+        f"  {info.hits} hits, {info.coalesced} coalesced, {info.misses} misses,"
+        f" hit rate {info.hit_rate:.0%}"
+    )
+    stub.close()
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_calls", type=int, default=200)
+    parser.add_argument("--max_concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import time
+
+from langchain_core.utils.function_calling import convert_to_openai_function
+
+from llm_in_production.agent_tools import (
+    get_current_weather,
+    get_news_stories,
+    get_stock_prices,
+)
+from llm_in_production.agent_utils import _get_react_prompt, _prepare_agent
+
+TOOLS = (get_stock_prices, get_news_stories, get_current_weather)
+
+
+def main():
+    args = arg_parser()
+
+    def prepare_without_cache():
+        # What every agent run did before the tool registry.
+        tool_definitions = [
+            {"type": "function", "function": convert_to_openai_function(tool)}
+            for tool in TOOLS
+        ]
+        tool_names = tuple(tool.__name__ for tool in TOOLS)
+        system_prompt = "You are a helpful assistant." + _get_react_prompt.__wrapped__(
+            tool_names
+        )
+        return tool_definitions, system_prompt
+
+    def prepare_with_cache():
+        return _prepare_agent(
+            "You are a helpful assistant.", "What is the weather?", TOOLS, react=True
+        )
+
+    print(f"Setup of an agent with {len(TOOLS)} tools, mean of {args.n_runs} runs:")
+    for name, prepare in [
+        ("convert every run", prepare_without_cache),
+        ("tool registry", prepare_with_cache),
+    ]:
+        prepare()  # Warm up, e.g. imports and the first conversion
+        start = time.perf_counter()
+        for _ in range(args.n_runs):
+            prepare()
+        elapsed = (time.perf_counter() - start) / args.n_runs
+        print(f"  {name:18} {elapsed * 1e6:8.1f} µs")
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_runs", type=int, default=1000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
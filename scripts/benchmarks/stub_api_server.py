@@ -0,0 +1,69 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubApiServer:
+    """
+    A local HTTP server that stands in for the weather and news APIs of the agent tools.
+    It answers every GET request with a small JSON body after a delay, and counts the requests.
+    """
+
+    def __init__(self, latency: float = 0.05, error_probability: float = 0.0):
+        """
+        :param latency: The seconds the server waits before it answers, like a remote API.
+        :param error_probability: The probability that a request fails with a 503.
+        """
+        self.latency = latency
+        self.error_probability = error_probability
+        self.n_requests = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep connections alive
+            # The headers and the body are sent separately, which Nagle's algorithm delays by 40 ms.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.n_requests += 1
+                time.sleep(stub.latency)
+                if random.random() < stub.error_probability:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = json.dumps(
+                    {
+                        "current": {"temp_c": 12.0, "condition": "Light rain"},
+                        "articles": [{"title": "Stocks rally"}],
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            # Accept many connections at once, the default backlog of 5 drops them.
+            request_queue_size = 256
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,7 +1,9 @@
 import dotenv
 
 import streamlit as st
+from llm_in_production.instrumentation import show_call_stats_in_sidebar
 from llm_in_production.llm import instantiate_langchain_model
+from llm_in_production.streaming import format_stream_stats, stream_response
 
 dotenv.load_dotenv()
 
@@ -72,8 +74,11 @@ if prompt:
         for m in st.session_state.messages:
             messages.append({"role": m["role"], "content": m["content"]})
 
-        response = client.invoke(
-            input=messages,
+        # Stream the response, so the first words are shown while the rest is generated
+        response = stream_response(
+            client,
+            messages,
+            on_update=lambda text: message_placeholder.markdown(text + "▌"),
             # Exercise: add max_tokens, temperature and top_p to the completion request
             # YOUR CODE HERE START: test 123
             max_tokens=max_tokens,
@@ -82,8 +87,13 @@ if prompt:
             # YOUR CODE HERE END
         )
         assistant_message = response.content
+        # Render the final answer without the cursor
         message_placeholder.markdown(assistant_message)
+        st.caption(format_stream_stats(response))
 
     st.session_state.messages.append(
         {"role": "assistant", "content": assistant_message}
     )
+
+# Show the latency of the LLM calls of this app, run at the end so it includes the calls of this run
+show_call_stats_in_sidebar()
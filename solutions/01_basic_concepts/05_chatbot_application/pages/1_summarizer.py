@@ -1,7 +1,9 @@
 import dotenv
 
 import streamlit as st
+from llm_in_production.instrumentation import show_call_stats_in_sidebar
 from llm_in_production.llm import instantiate_langchain_model
+from llm_in_production.streaming import format_stream_stats, stream_response
 
 dotenv.load_dotenv()
 
@@ -63,8 +65,11 @@ if prompt:
             {"role": "user", "content": prompt},
         ]
 
-        response = client.invoke(
-            input=messages,
+        # Stream the response, so the first words are shown while the rest is generated
+        response = stream_response(
+            client,
+            messages,
+            on_update=lambda text: message_placeholder.markdown(text + "▌"),
             # Exercise: add max_tokens, temperature and top_p to the completion request
             # YOUR CODE HERE START: test 123
             max_tokens=max_tokens,
@@ -73,4 +78,9 @@ if prompt:
             # YOUR CODE HERE END
         )
         message = response.content
+        # Render the final answer without the cursor
         message_placeholder.markdown(message)
+        st.caption(format_stream_stats(response))
+
+# Show the latency of the LLM calls of this app, run at the end so it includes the calls of this run
+show_call_stats_in_sidebar()
@@ -4,6 +4,7 @@ from typing import Any
 import pydantic
 
 import streamlit as st
+from llm_in_production.instrumentation import show_call_stats_in_sidebar
 from llm_in_production.llm import instantiate_langchain_model
 from llm_in_production.text_extraction import (
     BooleanFeature,
@@ -301,3 +302,6 @@ with col2:
 
     else:
         st.write("No features yet")
+
+# Show the latency of the LLM calls of this app, run at the end so it includes the calls of this run
+show_call_stats_in_sidebar()
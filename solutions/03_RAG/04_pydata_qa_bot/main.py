@@ -1,15 +1,31 @@
+import inspect
 import json
+import threading
 from pathlib import Path
+from typing import NamedTuple
 
 import dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 
 import streamlit as st
+from llm_in_production.embedding_cache import CachedEmbeddings
 from llm_in_production.huggingface_utils import get_device
+from llm_in_production.hybrid_search import BM25Index, hybrid_search
+from llm_in_production.instrumentation import show_call_stats_in_sidebar
 from llm_in_production.llm import instantiate_langchain_model
-from llm_in_production.rag_utils import pop_messages_until_within_token_limit
+from llm_in_production.rag_utils import (
+    FaissIndexSpec,
+    build_or_update_faiss_index,
+    get_index_cache_key,
+    load_faiss_index,
+    pop_messages_until_within_token_limit,
+    save_faiss_index,
+    set_faiss_search_params,
+)
+from llm_in_production.semantic_cache import SemanticCache
+from llm_in_production.streaming import format_stream_stats, stream_response
+from llm_in_production.text_splitting import RecursiveTokenTextSplitter
 
 title = "PyData Amsterdam 2023 Q&A bot"
 st.set_page_config(
@@ -31,28 +47,60 @@ st.write("Powered by", client.model_name)
 
 
 MAX_TOKENS = 8192
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+DATA_PATH = Path(__file__).parent / "../pydata.json"
+# Built vector databases are stored here, so they only have to be built once.
+INDEX_CACHE_DIR = Path(__file__).parent / ".index_cache"
 
 # Here we load in the PyData Amsterdam 2023 data.
-with open(Path(__file__).parent / "../pydata.json", "r") as f:
+with open(DATA_PATH, "r") as f:
     pydata_data = json.load(f)
     talks = pydata_data["talks"]
 
 
-def build_db(chunk_size: int, chunk_overlap: int):
+@st.cache_resource
+def get_embedding_function() -> CachedEmbeddings:
+    """
+    Get the function that embeds the chunks and the questions.
+    The model is loaded once per server process and shared by all sessions, instead of once per user.
+    """
+    # The embeddings are cached on disk, so only texts that were never embedded before are sent to the model.
+    return CachedEmbeddings(
+        HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL_NAME, model_kwargs={"device": get_device()}
+        ),
+        model_name=EMBEDDING_MODEL_NAME,
+    )
+
+
+def build_db(
+    chunk_size: int,
+    chunk_overlap: int,
+    db=None,
+    index_spec: FaissIndexSpec | None = None,
+):
     """
-    Build the vector store that will be used to search through the talks.
+    Build the vector store and the keyword index that will be used to search through the talks.
     :param chunk_size: The max number of tokens per chunk.
     :param chunk_overlap: The number of overlapping tokens between chunks.
-    :return: A vector database.
+    :param db: The current vector database, if any. Only the chunks that changed are re-embedded.
+    :param index_spec: The kind of FAISS index, an exact flat index by default.
+    :return: A vector database and a BM25 index over the same chunks.
     """
 
-    # Here we create the embedding function that will be used to embed the sentences.
-    embedding_func = HuggingFaceEmbeddings(
-        model_name="all-MiniLM-L6-v2", model_kwargs={"device": get_device()}
+    # Here we get the embedding function that will be used to embed the sentences.
+    embedding_func = get_embedding_function()
+
+    # Here we load the vector database from disk if it was already built with the same data and settings.
+    cache_path = INDEX_CACHE_DIR / get_index_version(
+        chunk_size, chunk_overlap, index_spec
     )
+    if cache_path.exists():
+        return load_faiss_index(cache_path, embedding_func), BM25Index.load(cache_path)
 
     # Here we create the text splitter that will be used to split the talks into chunks.
-    text_splitter = RecursiveCharacterTextSplitter(
+    # It tokenizes every text once with a local tokenizer, instead of calling the model for every fragment.
+    text_splitter = RecursiveTokenTextSplitter.from_tiktoken_encoder(
         # Set a really small chunk size, just to show.
         separators=[
             "\n\n",
@@ -65,7 +113,6 @@ def build_db(chunk_size: int, chunk_overlap: int):
         ],  # Feel free to add more separators.
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
-        length_function=client.get_num_tokens,
         keep_separator=True,  # Feel free to change this.
         strip_whitespace=True,  # Feel free to change this.
     )
@@ -113,8 +160,105 @@ def build_db(chunk_size: int, chunk_overlap: int):
             metadatas.append(metadata)
         # YOUR CODE HERE END
 
-    # Here we create the vector database.
-    return FAISS.from_texts(texts, metadatas=metadatas, embedding=embedding_func)
+    # Here we create the vector database, or update the current one, and store it for the next session.
+    db = build_or_update_faiss_index(
+        texts, metadatas, embedding_func, db=db, index_spec=index_spec
+    )
+    # Here we create a keyword index over the same chunks, which finds exact names that embeddings tend to miss.
+    bm25_index = BM25Index.from_faiss(db)
+    save_faiss_index(db, cache_path, bm25_index=bm25_index)
+    return db, bm25_index
+
+
+def get_index_version(
+    chunk_size: int, chunk_overlap: int, index_spec: FaissIndexSpec | None
+) -> str:
+    """
+    Get the version of the vector database, which changes whenever the data or the settings change.
+    The source of `build_db` is part of the version, so changing its code also rebuilds the database.
+    :param chunk_size: The max number of tokens per chunk.
+    :param chunk_overlap: The number of overlapping tokens between chunks.
+    :param index_spec: The kind of FAISS index.
+    :return: The version.
+    """
+    return get_index_cache_key(
+        DATA_PATH,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        embedding_model=EMBEDDING_MODEL_NAME,
+        index_spec=index_spec,
+        build_db_source=inspect.getsource(build_db),
+    )
+
+
+class SearchIndex(NamedTuple):
+    db: FAISS
+    bm25_index: BM25Index
+    version: str
+    # The search parameters are set on the shared FAISS index, so they are set and used under a lock.
+    lock: threading.Lock
+
+
+class LatestSearchIndex:
+    """Holds the search index that was built last by the server process."""
+
+    def __init__(self):
+        self.search_index: SearchIndex | None = None
+
+
+@st.cache_resource
+def get_latest_search_index() -> LatestSearchIndex:
+    """
+    Get the search index that was built last, shared by all sessions.
+    It survives a re-index, so the next build only embeds the chunks that changed.
+    """
+    return LatestSearchIndex()
+
+
+@st.cache_resource(max_entries=4)
+def get_search_index(
+    chunk_size: int, chunk_overlap: int, index_spec: FaissIndexSpec
+) -> SearchIndex:
+    """
+    Get the vector database and the keyword index for these settings.
+    They are only read after they are built, so they are shared by all sessions of the server process,
+    and every user after the first one gets them without loading anything.
+    :param chunk_size: The max number of tokens per chunk.
+    :param chunk_overlap: The number of overlapping tokens between chunks.
+    :param index_spec: The kind of FAISS index.
+    :return: The indexes and their version.
+    """
+    latest = get_latest_search_index()
+    # Update the index that was built last, e.g. with other chunk settings, instead of building from scratch.
+    previous = latest.search_index
+    db, bm25_index = build_db(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        db=previous.db if previous is not None else None,
+        index_spec=index_spec,
+    )
+    version = get_index_version(chunk_size, chunk_overlap, index_spec)
+    latest.search_index = SearchIndex(db, bm25_index, version, threading.Lock())
+    return latest.search_index
+
+
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    """
+    Get the cache of answers to earlier search queries.
+    It is shared by all sessions, so a question that any user asked before is answered without an LLM call.
+    """
+    return SemanticCache()
+
+
+def get_semantic_cache_scope(index_version: str, **settings) -> str:
+    """
+    Get the scope of the cached answers, so an answer is only reused for the same index and the same settings.
+    :param index_version: The version of the search index that the answers are based on.
+    :param settings: The settings of the search and the LLM call, e.g. the max tokens and the temperature.
+    :return: The scope.
+    """
+    return json.dumps({"index_version": index_version, **settings}, sort_keys=True)
 
 
 def format_search_result(document, idx: int) -> str:
@@ -194,7 +338,9 @@ with st.sidebar:
     )
 
     st.header("Vector database settings")
-    st.markdown("Changing these settings require a reindexing of the database.")
+    st.markdown(
+        "Changing these settings builds another database, which is shared by all users."
+    )
     # Exercise: add settings for max_tokens, temperature and top_p
     chunk_size = st.number_input(
         "Max number of tokens per chunk", min_value=1, value=150, step=1, max_value=256
@@ -206,27 +352,65 @@ with st.sidebar:
         step=1,
         max_value=chunk_size // 2,
     )
+    # The approximate indexes are only worth it for much larger archives than a single conference.
+    index_kind = st.selectbox(
+        "Index type", options=["flat", "ivf_flat", "hnsw", "ivf_pq"], index=0
+    )
+    index_spec = FaissIndexSpec(kind=index_kind, n_lists=16, pq_m=16)
+
+    st.header("Search settings")
+    nprobe = st.number_input(
+        "Number of IVF lists to search (nprobe)",
+        min_value=1,
+        value=4,
+        step=1,
+        max_value=index_spec.n_lists,
+    )
+    ef_search = st.number_input(
+        "HNSW search depth (efSearch)", min_value=1, value=64, step=1, max_value=512
+    )
+    # The candidates of both searches are fused with reciprocal rank fusion.
+    k_dense = st.number_input(
+        "Number of vector search candidates",
+        min_value=0,
+        value=10,
+        step=1,
+        max_value=50,
+    )
+    k_sparse = st.number_input(
+        "Number of keyword search candidates",
+        min_value=0,
+        value=10,
+        step=1,
+        max_value=50,
+    )
+    use_semantic_cache = st.checkbox(
+        "Reuse the answers to similar questions (semantic cache)", value=True
+    )
+    # Questions that are this similar to an earlier question get the earlier answer.
+    semantic_cache_threshold = st.slider(
+        "Semantic cache similarity threshold",
+        min_value=0.5,
+        value=0.9,
+        step=0.01,
+        max_value=1.0,
+    )
 
     def on_reindex():
         """Start the reindexing process of the vector database."""
-        if "db" in st.session_state:
-            # Delete the old database
-            del st.session_state["db"]
-
-        # Store a new database
-        st.session_state["db"] = build_db(
-            chunk_size=chunk_size, chunk_overlap=chunk_overlap
-        )
+        # Drop the shared databases, they are rebuilt on the next run from the one that was built last,
+        # so only the chunks that changed are embedded again.
+        # Answers that were based on another version of the database are no longer used.
+        get_search_index.clear()
 
     submit = st.button("Re-index", on_click=on_reindex)
 
+# A session only holds its chat history, the model and the indexes are shared by all sessions.
 if "messages" not in st.session_state:
     st.session_state["messages"] = []
 
-if "db" not in st.session_state:
-    st.session_state["db"] = build_db(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap
-    )
+# The first run of the server process loads the model and the indexes, every later session finds them warm.
+search_index = get_search_index(chunk_size, chunk_overlap, index_spec)
 
 
 #    Display chat messages from history on app rerun
@@ -244,11 +428,47 @@ prompt = st.chat_input(
     "What is your question about PyData Amsterdam 2023? (Click the checkbox to search through the talk descriptions)"
 )
 if prompt:
+    cache_hit = None
+    # An answer also depends on the chat history before the question, which is not shared between users,
+    # so only the answers to the first question of a conversation are cached.
+    use_cache = search_talks and use_semantic_cache and not st.session_state.messages
     # Check if the user wants to search through the talks
     if search_talks:
+        # Embed the question once, it is used for both the semantic cache and the vector search
+        query = prompt
+        query_vector = search_index.db.embeddings.embed_query(query)
+    if use_cache:
+        semantic_cache = get_semantic_cache()
+        cache_scope = get_semantic_cache_scope(
+            search_index.version,
+            max_tokens=max_tokens,
+            # YOUR CODE HERE START: Add the settings for temperature and top_p
+            temperature=temperature,
+            top_p=top_p,
+            # YOUR CODE HERE END
+            n_search_results=n_search_results,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            k_dense=k_dense,
+            k_sparse=k_sparse,
+        )
+        cache_hit = semantic_cache.lookup(
+            query_vector, scope=cache_scope, threshold=semantic_cache_threshold
+        )
+
+    if cache_hit is None and search_talks:
         # Search through the talks
-        db = st.session_state.db
-        documents = db.similarity_search(prompt, k=n_search_results)
+        with search_index.lock:
+            set_faiss_search_params(search_index.db, nprobe=nprobe, ef_search=ef_search)
+            documents = hybrid_search(
+                search_index.db,
+                search_index.bm25_index,
+                prompt,
+                k=n_search_results,
+                k_dense=k_dense,
+                k_sparse=k_sparse,
+                query_vector=query_vector,
+            )
         # Change the prompt to the result of the search
         prompt = format_search_instruction(prompt, documents)
 
@@ -263,36 +483,48 @@ if prompt:
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
 
-        messages = [
-            # Add a system message that describes the bot and general information about PyData Amsterdam 2023
-            # such as the start and end date and the rooms.
-            # YOUR CODE HERE START
-            {
-                "role": "system",
-                "content": "You are a Q&A bot for PyData Amsterdam 2023. "
-                + f"It starts on {pydata_data['start_date']} "
-                f"and ends on {pydata_data['end_date']}. "
-                f"The rooms have the following names and capacities: {pydata_data['rooms']}.",
-            },
-            # YOUR CODE HERE END
-        ]
-        # Add all the messages from the chat history to the messages list
-        for m in st.session_state.messages:
-            messages.append({"role": m["role"], "content": m["content"]})
-        # Ensures that the text fits into the token limit of the model by removing the oldest messages
-        messages = pop_messages_until_within_token_limit(
-            messages, MAX_TOKENS - max_tokens, client
-        )
-
-        response = client.invoke(
-            input=messages,
-            max_tokens=max_tokens,
-            # YOUR CODE HERE START: Add the settings for temperature and top_p
-            temperature=temperature,
-            top_p=top_p,
-            # YOUR CODE HERE END
-        )
-        assistant_message = response.content
+        if cache_hit is not None:
+            # A similar question was answered before, so the search and the LLM call are skipped
+            assistant_message = cache_hit.answer
+        else:
+            messages = [
+                # Add a system message that describes the bot and general information about PyData Amsterdam 2023
+                # such as the start and end date and the rooms.
+                # YOUR CODE HERE START
+                {
+                    "role": "system",
+                    "content": "You are a Q&A bot for PyData Amsterdam 2023. "
+                    + f"It starts on {pydata_data['start_date']} "
+                    f"and ends on {pydata_data['end_date']}. "
+                    f"The rooms have the following names and capacities: {pydata_data['rooms']}.",
+                },
+                # YOUR CODE HERE END
+            ]
+            # Add all the messages from the chat history to the messages list
+            for m in st.session_state.messages:
+                messages.append({"role": m["role"], "content": m["content"]})
+            # Ensures that the text fits into the token limit of the model by removing the oldest messages
+            messages = pop_messages_until_within_token_limit(
+                messages, MAX_TOKENS - max_tokens, client
+            )
+
+            # Stream the response, so the first words are shown while the rest is generated
+            response = stream_response(
+                client,
+                messages,
+                on_update=lambda text: message_placeholder.markdown(text + "▌"),
+                max_tokens=max_tokens,
+                # YOUR CODE HERE START: Add the settings for temperature and top_p
+                temperature=temperature,
+                top_p=top_p,
+                # YOUR CODE HERE END
+            )
+            assistant_message = response.content
+            st.caption(format_stream_stats(response))
+            if use_cache:
+                semantic_cache.add(
+                    query_vector, query, assistant_message, scope=cache_scope
+                )
         # Display assistant message in chat message container
         message_placeholder.markdown(assistant_message)
 
@@ -300,3 +532,6 @@ if prompt:
     st.session_state.messages.append(
         {"role": "assistant", "content": assistant_message}
     )
+
+# Show the latency of the LLM calls of this app, run at the end so it includes the calls of this run
+show_call_stats_in_sidebar()
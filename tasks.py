@@ -161,3 +161,19 @@ def generate_exercises_streamlit(c):
     c.run(
         f"python {path} --input_folder {input_folder} --output_folder {output_folder}"
     )
+
+
+@task
+def benchmark(c, name):
+    """Run one of the benchmarks in scripts/benchmarks, e.g. `invoke benchmark --name text_splitter`."""
+    path = REPO_ROOT / "scripts" / "benchmarks" / f"benchmark_{name}.py"
+    path = path.resolve().absolute()
+    c.run(f"python {path}")
+
+
+@task
+def import_time(c, module=None):
+    """Measure the import time of every entry point of llm_in_production and which heavy dependencies it pulls in."""
+    path = REPO_ROOT / "scripts" / "benchmarks" / "benchmark_import_time.py"
+    path = path.resolve().absolute()
+    c.run(f"python {path}" + (f" --module {module}" if module else ""))